@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''Compare how fast pip and uv install a wheelhouse for build-python and
+cross-python.
+
+Usage: installer_speed.py ENV_DIR [WHEELHOUSE] [REPEAT]
+
+ENV_DIR is an existing cross environment. Every wheel in WHEELHOUSE is
+installed, with --no-index, into a fresh --prefix each time, the same way
+crossenv installs cross-pip when it has to. Without a WHEELHOUSE, one of
+synthetic pure-Python wheels that depend on each other is made, so that
+there's something to resolve. uv is found as 'crossenv --installer=uv' would
+find it; if it can't be, only pip is timed.
+'''
+
+import base64
+import hashlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from crossenv import installers
+
+PACKAGES = 50
+MODULES = 20
+
+def record_line(name, data):
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return '%s,sha256=%s,%d\n' % (name, digest.rstrip(b'=').decode(),
+            len(data))
+
+def make_wheel(directory, name, version, requires):
+    dist = '%s-%s' % (name, version)
+    files = {}
+    for i in range(MODULES):
+        files['%s/mod%02d.py' % (name, i)] = ''.join(
+                'def f%d(x):\n    return x * %d\n\n' % (j, j)
+                for j in range(50))
+    files['%s/__init__.py' % name] = 'VERSION = %r\n' % version
+    files['%s.dist-info/METADATA' % dist] = (
+            'Metadata-Version: 2.1\nName: %s\nVersion: %s\n' % (name, version)
+            + ''.join('Requires-Dist: %s\n' % req for req in requires))
+    files['%s.dist-info/WHEEL' % dist] = (
+            'Wheel-Version: 1.0\nGenerator: installer_speed\n'
+            'Root-Is-Purelib: true\nTag: py3-none-any\n')
+
+    record_name = '%s.dist-info/RECORD' % dist
+    path = os.path.join(directory, '%s-py3-none-any.whl' % dist)
+    with zipfile.ZipFile(path, 'w') as zf:
+        record = ''
+        for member, text in files.items():
+            data = text.encode('utf-8')
+            zf.writestr(member, data)
+            record += record_line(member, data)
+        zf.writestr(record_name, record + '%s,,\n' % record_name)
+
+def make_wheelhouse(directory):
+    for i in range(PACKAGES):
+        requires = ['bench_pkg_%03d>=1.0' % j for j in range(max(0, i - 3), i)]
+        make_wheel(directory, 'bench_pkg_%03d' % i, '1.0', requires)
+
+def requirements(wheelhouse):
+    reqs = []
+    for name in sorted(os.listdir(wheelhouse)):
+        if name.endswith('.whl'):
+            dist, version = name.split('-')[:2]
+            reqs.append('%s==%s' % (dist, version))
+    return reqs
+
+def measure(installer, python, wheelhouse, repeat):
+    reqs = requirements(wheelhouse)
+    options = ['--no-index', '--find-links', wheelhouse]
+    times = []
+    for _ in range(repeat):
+        prefix = tempfile.mkdtemp(prefix='installer-speed-')
+        try:
+            start = time.perf_counter()
+            installer.install(python, reqs, prefix=prefix, reinstall=True,
+                    options=options)
+            times.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(prefix)
+    return statistics.median(times)
+
+def main():
+    if len(sys.argv) not in (2, 3, 4):
+        sys.exit(__doc__.strip())
+    env_dir = sys.argv[1]
+    wheelhouse = sys.argv[2] if len(sys.argv) > 2 else None
+    repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    backends = [installers.PipInstaller()]
+    uv = installers.UvInstaller.find()
+    if uv is not None:
+        backends.append(uv)
+
+    tmp = None
+    if wheelhouse is None:
+        tmp = wheelhouse = tempfile.mkdtemp(prefix='wheelhouse-')
+        make_wheelhouse(wheelhouse)
+    try:
+        count = len(requirements(wheelhouse))
+        print('%d wheels, median of %d runs' % (count, repeat))
+        print('%-6s %14s %14s' % ('', 'build-python', 'cross-python'))
+        for installer in backends:
+            row = []
+            for name in ('build', 'cross'):
+                python = os.path.join(env_dir, name, 'bin', 'python')
+                row.append(measure(installer, python, wheelhouse, repeat))
+            print('%-6s %13.2fs %13.2fs' % (installer.name, row[0], row[1]))
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+'''Compare how fast cross-python and build-python can start subprocesses.
+
+Usage: spawn_rate.py ENV_DIR [COUNT]
+
+ENV_DIR is an existing cross environment. Build backends start the compiler
+once per source file, so cross-python should be able to keep up with
+build-python here.
+'''
+
+import os
+import subprocess
+import sys
+from textwrap import dedent
+
+SCRIPT = dedent('''\
+    import subprocess, sys, time
+    count = int(sys.argv[1])
+    start = time.perf_counter()
+    for _ in range(count):
+        subprocess.run(['/bin/true'])
+    elapsed = time.perf_counter() - start
+    print(count / elapsed, subprocess._USE_POSIX_SPAWN,
+          getattr(subprocess, '_USE_VFORK', False))
+    ''')
+
+def measure(python, count):
+    out = subprocess.check_output([python, '-c', SCRIPT, str(count)],
+            universal_newlines=True)
+    rate, posix_spawn, vfork = out.split()
+    return float(rate), posix_spawn, vfork
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__.strip())
+    env_dir = sys.argv[1]
+    count = int(sys.argv[2]) if len(sys.argv) == 3 else 2000
+
+    print('%-14s %12s %12s %8s' % ('', 'spawns/sec', 'posix_spawn', 'vfork'))
+    for name in ('build-python', 'cross-python'):
+        python = os.path.join(env_dir, 'bin', name)
+        rate, posix_spawn, vfork = measure(python, count)
+        print('%-14s %12.0f %12s %8s' % (name, rate, posix_spawn, vfork))
+
+if __name__ == '__main__':
+    main()
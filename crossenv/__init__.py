@@ -8,13 +8,27 @@ from textwrap import dedent
 import subprocess
 import logging
 import importlib
+import importlib.util
 import random
 import shlex
 import pprint
 import re
+import marshal
+import json
+import py_compile
+import hashlib
+import types
+import threading
+import site
+import pkgutil
+import csv
+from concurrent.futures import ThreadPoolExecutor
 
 from .utils import F
 from . import utils
+from .emulation import CrossEmulation
+from .store import Store
+from . import installers
 
 __version__ = '1.5.0'
 
@@ -22,6 +36,31 @@ logger = logging.getLogger(__name__)
 
 APPLE_MOBILE_PLATFORMS = {"ios", "tvos", "watchos"}
 
+# Log records made while creating environments in parallel are held back here,
+# per thread, by _CapturedLogFilter.
+_log_capture = threading.local()
+
+class _CapturedLogFilter(logging.Filter):
+    """Hold back log records from threads that are capturing them"""
+    def filter(self, record):
+        records = getattr(_log_capture, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+def _with_captured_log(func):
+    """Wrap func so that, run in another thread, its log records are captured
+    along with the calling thread's"""
+    records = getattr(_log_capture, 'records', None)
+    def wrapper(*args, **kwargs):
+        _log_capture.records = records
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _log_capture.records = None
+    return wrapper
+
 
 class CrossEnvBuilder(venv.EnvBuilder):
     """
@@ -108,6 +147,48 @@ class CrossEnvBuilder(venv.EnvBuilder):
                             from PyPI.
     :param host_machine:    Host machine override seen by cross-python at
                             runtime. Default is guessed from host-python.
+    :param launcher:        How the cross-python executable sets up its
+                            environment. 'sh' (the default) uses a shell script
+                            that execs build-python directly. 'python' uses a
+                            Python script, at the cost of starting an extra
+                            interpreter.
+    :param single_file_bootstrap:
+                            If True, embed all of cross-python's patches in
+                            a single bootstrap module, rather than writing them
+                            to separate files. This minimizes the files touched
+                            when cross-python starts.
+    :param unchecked_hash_pycs:
+                            If True, write the bytecode for the modules we
+                            generate as unchecked-hash .pyc files, which are
+                            used without looking at the source. This suits
+                            read-only or relocated environments. Requires
+                            Python 3.7 or later.
+    :param check_compiler:
+                            If True, run the cross-compiler to check it and to
+                            ask it for its sysroot. If False, the compiler
+                            isn't needed, which suits using the builder only
+                            to emulate the host (see CrossEmulation).
+    :param host_cache:      If True, save what we learn about host-python and
+                            the cross-compiler, and use it next time instead of
+                            asking again, so long as none of the files involved
+                            have changed.
+    :param refresh_host_cache:
+                            If True, ask host-python and the cross-compiler
+                            again, even if the answers are cached, and cache
+                            the new answers.
+    :param cache_dir:       Where to keep caches. Defaults to crossenv's
+                            directory in ~/.cache, or $XDG_CACHE_HOME.
+    :param env_cache:       If True, keep a copy of the first environment
+                            made with each configuration, and make later
+                            ones by copying it, rather than from scratch.
+    :param store:           If given, the directory of a Store to share the
+                            environment's files through, along with whatever
+                            cross-pip installs later.
+    :param installer:       What to install packages with while making the
+                            environment: 'pip', 'uv', or 'auto', for uv if it
+                            can be found and pip if not. uv is only used for
+                            cross-python if there are no platform tags. With
+                            uv, build-uv and cross-uv are added too.
     """
     def __init__(self, *,
             host_python,
@@ -126,7 +207,17 @@ class CrossEnvBuilder(venv.EnvBuilder):
             host_sysconfigdata_file=None,
             manylinux_tags=(),
             platform_tags=(),
-            host_machine=None):
+            host_machine=None,
+            launcher='sh',
+            single_file_bootstrap=False,
+            unchecked_hash_pycs=False,
+            check_compiler=True,
+            host_cache=True,
+            refresh_host_cache=False,
+            cache_dir=None,
+            env_cache=False,
+            store=None,
+            installer='pip'):
         self.host_sysroot = host_sysroot
         self.host_cc = None
         self.host_cxx = None
@@ -138,7 +229,7 @@ class CrossEnvBuilder(venv.EnvBuilder):
         if host_ar:
             self.host_ar = shlex.split(host_ar)
         self.host_relativize = host_relativize
-        self.host_config_vars = host_config_vars
+        self.host_config_vars = dict(host_config_vars)
         self.host_sysconfigdata_file = host_sysconfigdata_file
         self.build_system_site_packages = build_system_site_packages
         self.extra_env_vars = extra_env_vars
@@ -156,12 +247,43 @@ class CrossEnvBuilder(venv.EnvBuilder):
         self.manylinux_tags = manylinux_tags
         self.platform_tags = platform_tags
         self.host_machine = host_machine
+        if launcher not in ('sh', 'python'):
+            raise ValueError("Unknown launcher %r" % launcher)
+        self.launcher = launcher
+        self.single_file_bootstrap = single_file_bootstrap
+        if (unchecked_hash_pycs and
+                not hasattr(py_compile, 'PycInvalidationMode')):
+            raise ValueError("Unchecked-hash pycs require Python 3.7 or later")
+        self.unchecked_hash_pycs = unchecked_hash_pycs
+
+        if cache_dir is None:
+            cache_dir = utils.default_cache_dir()
+        self.cache_dir = cache_dir
+        self.host_cache = self.open_host_cache(host_python, host_cache,
+                refresh_host_cache)
+        self.env_cache = env_cache
+        self._env_template = None
+        self.store = Store(store) if store else None
+        self.installer = installers.get_installer(installer)
 
         self.find_host_python(host_python)
-        self.find_compiler_info()
+        if check_compiler:
+            self.find_compiler_info()
         self.get_uname_info()
         self.expand_platform_tags()
 
+        self.cross_installer = self.installer
+        if not self.installer.honours_platform_tags(self.platform_tags):
+            logger.info("Using pip for cross-python, since %s can't choose "
+                    "packages by platform tags", self.installer.name)
+            self.cross_installer = installers.PipInstaller()
+
+        try:
+            self.host_cache.save()
+        except OSError as e:
+            logger.warning("Cannot save host information to %s: %s",
+                    self.host_cache.path, e)
+
         super().__init__(
                 system_site_packages=False,
                 clear=False,
@@ -170,6 +292,26 @@ class CrossEnvBuilder(venv.EnvBuilder):
                 with_pip=False)
 
 
+    def open_host_cache(self, host, enabled, refresh):
+        """
+        Open the cache of what we've learned about a host-python before. Each
+        host-python executable, as seen by each build-python version, gets its
+        own cache file.
+
+        :param host:    Path to the host Python executable.
+        :param enabled: If False, don't use a cache at all.
+        :param refresh: If True, ignore what's already cached.
+        """
+
+        host = os.path.abspath(host)
+        self.host_identity = utils.file_identity(host)
+        if not enabled:
+            return utils.ProbeCache(None)
+        name = hashlib.sha256(('%s\0%s' % (host, sys.version)).encode(
+                'utf-8', 'surrogateescape')).hexdigest()[:32]
+        path = os.path.join(self.cache_dir, 'host-info', name + '.marshal')
+        return utils.ProbeCache(path, refresh)
+
     def find_installed_host_home(self):
         # Assume host_project_base == {prefix}/bin and that this Python
         # mirrors the host Python's install paths.
@@ -188,6 +330,24 @@ class CrossEnvBuilder(venv.EnvBuilder):
         return home
 
     def find_sysconfig_data(self, paths):
+        # Searching for sysconfigdata and loading it is slow, so use what we
+        # found last time if nothing has changed: neither the directories we
+        # searched, nor the files we found there.
+        search_dirs = set()
+        for path in paths:
+            search_dirs.update(d for d in glob.glob(path) if os.path.isdir(d))
+        cache_key = (self.host_identity, self.host_sysconfigdata_file,
+                tuple(utils.file_identity(d) for d in sorted(search_dirs)))
+        cached = self.host_cache.get('sysconfigdata', cache_key)
+        if cached is not None:
+            found, path, name, data = cached
+            if all(utils.file_identity(f[0]) == f for f in found):
+                self.host_sysconfigdata = types.ModuleType(name)
+                self.host_sysconfigdata.__dict__.update(data)
+                self.host_sysconfigdata_file = path
+                self.host_sysconfigdata_name = name
+                return
+
         maybe = []
         for path in paths:
             pattern = os.path.join(path, '_sysconfigdata*.py*')
@@ -232,6 +392,15 @@ class CrossEnvBuilder(venv.EnvBuilder):
                     ', '.join(paths))
             raise FileNotFoundError("No _sysconfigdata*.py found in host lib")
 
+        data = {}
+        for key, value in self.host_sysconfigdata.__dict__.items():
+            if not key.startswith('__'):
+                data[key] = value
+        found = tuple(utils.file_identity(path) for path in sysconfig_paths)
+        self.host_cache.put('sysconfigdata', cache_key,
+                (found, self.host_sysconfigdata_file,
+                 self.host_sysconfigdata_name, data))
+
 
     def _is_python_source_dir(self, d):
         fn = getattr(sysconfig, '_is_python_source_dir', None)
@@ -340,20 +509,9 @@ class CrossEnvBuilder(venv.EnvBuilder):
         self.host_version = self.host_sysconfigdata.build_time_vars['VERSION']
         self.host_gnu_type = self.host_sysconfigdata.build_time_vars['HOST_GNU_TYPE']
 
-        self.host_platform = None
         # Ask the makefile a few questions too
-        if os.path.exists(self.host_makefile):
-            with open(self.host_makefile, 'r') as fp:
-                lines = list(fp.readlines())
-            for line in lines:
-                line = line.strip()
-                if line.startswith('_PYTHON_HOST_PLATFORM='):
-                    host_platform = line.split('=',1)[-1].strip()
-                    if host_platform:
-                        self.host_platform = host_platform
-                    break
-        else:
-            lines = []
+        self.host_platform, self.macosx_deployment_target = \
+                self.read_makefile_info()
 
         if self.host_platform is None:
             # It was probably natively compiled, but not necessarily for this
@@ -377,17 +535,49 @@ class CrossEnvBuilder(venv.EnvBuilder):
                 logger.warning("Cannot determine platform. Using build.")
                 self.host_platform = sysconfig.get_platform()
 
-        self.macosx_deployment_target = ''
+        # Sanity checks
+        if self.host_version != build_version:
+            raise ValueError("Version mismatch: host=%s, build=%s" % (
+                self.host_version, build_version))
+
+    def read_makefile_info(self):
+        """
+        Read _PYTHON_HOST_PLATFORM and MACOSX_DEPLOYMENT_TARGET from the host's
+        Makefile. Returns (host_platform, macosx_deployment_target), where
+        host_platform may be None.
+        """
+
+        cache_key = (self.host_identity,
+                utils.file_identity(self.host_makefile))
+        cached = self.host_cache.get('makefile', cache_key)
+        if cached is not None:
+            return cached
+
+        host_platform = None
+        macosx_deployment_target = ''
+        if os.path.exists(self.host_makefile):
+            with open(self.host_makefile, 'r') as fp:
+                lines = list(fp.readlines())
+        else:
+            lines = []
+
+        for line in lines:
+            line = line.strip()
+            if line.startswith('_PYTHON_HOST_PLATFORM='):
+                value = line.split('=',1)[-1].strip()
+                if value:
+                    host_platform = value
+                break
+
         for line in lines:
             line = line.strip()
             if line.startswith('MACOSX_DEPLOYMENT_TARGET='):
-                self.macosx_deployment_target = line.split('=',1)[-1]
+                macosx_deployment_target = line.split('=',1)[-1]
                 break
 
-        # Sanity checks
-        if self.host_version != build_version:
-            raise ValueError("Version mismatch: host=%s, build=%s" % (
-                self.host_version, build_version))
+        result = (host_platform, macosx_deployment_target)
+        self.host_cache.put('makefile', cache_key, result)
+        return result
 
     def find_compiler_info(self):
         """
@@ -395,18 +585,31 @@ class CrossEnvBuilder(venv.EnvBuilder):
         and also check that it exists.
         """
 
-        def run_compiler(arg):
-            cmdline = self.host_cc + [arg]
-            return subprocess.run(cmdline,
-                                  universal_newlines=True,
-                                  stdout=subprocess.PIPE,
-                                  stderr=subprocess.PIPE)
-
-        if not shutil.which(self.host_cc[0]):
+        compiler = shutil.which(self.host_cc[0])
+        if not compiler:
             raise RuntimeError(
                 "Cannot find cross-compiler (%r)! Extension modules won't "
                 "build! Use --cc to correct." % ' '.join(self.host_cc))
 
+        # The compiler's answers are cached for as long as it's the same
+        # binary being run the same way.
+        cache_key = (tuple(self.host_cc), compiler,
+                utils.file_identity(os.path.realpath(compiler)))
+        results = self.host_cache.get('compiler', cache_key)
+        if results is None:
+            results = {}
+
+        def run_compiler(arg):
+            cmdline = self.host_cc + [arg]
+            if arg not in results:
+                res = subprocess.run(cmdline,
+                                     universal_newlines=True,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+                results[arg] = (res.returncode, res.stdout, res.stderr)
+                self.host_cache.put('compiler', cache_key, results)
+            return subprocess.CompletedProcess(cmdline, *results[arg])
+
         # Check that it runs, but failing this is a warning. Some compilers,
         # like QNX's qcc, do not have useful arguments we can pass to get a
         # successful return value.
@@ -483,18 +686,266 @@ class CrossEnvBuilder(venv.EnvBuilder):
 
         return parts
 
-    def create(self, env_dir):
+    def create(self, env_dir, jobs=1):
         """
         Create a cross virtual environment in a directory
 
         :param env_dir: The target directory to create an environment in.
+        :param jobs:    If more than 1, set up cross-python's virtual
+                        environment while build-python's is being created.
         """
 
         env_dir = os.path.abspath(env_dir)
+        template = self.find_env_template(env_dir)
+        if template is not None:
+            self.create_from_template(env_dir, template)
+            self.add_to_store(env_dir)
+            return
+
         context = self.ensure_directories(env_dir)
-        self.make_build_python(context)
+        if jobs > 1:
+            # Leaving the with block waits for build-python, even if
+            # something went wrong here.
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                build = pool.submit(_with_captured_log(self.make_build_python),
+                        context)
+                self.make_cross_venv(context)
+            build.result()
+        else:
+            self.make_build_python(context)
+            self.make_cross_venv(context)
         self.make_cross_python(context)
         self.post_setup(context)
+        self.save_env_template(context)
+        self.add_to_store(env_dir)
+
+    def add_to_store(self, env_dir):
+        """
+        Share the environment's files through the store, if there is one
+        """
+
+        if self.store is None:
+            return
+        logger.info("Adding files to the store")
+        saved = self.store.add_env(env_dir)
+        logger.debug("Saved %d bytes", saved)
+
+    def env_template_path(self):
+        """
+        Where the template for environments made with this configuration is
+        kept. Everything that goes into making an environment, other than its
+        path, goes into the name: crossenv itself, build-python and the pip it
+        comes with, host-python, and all of our options. Returns None if the
+        environment cache is disabled.
+        """
+
+        if not self.env_cache:
+            return None
+        if self._env_template is not None:
+            return self._env_template
+
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        crossenv_files = []
+        for dirpath in (package_dir, os.path.join(package_dir, 'scripts')):
+            try:
+                names = sorted(os.listdir(dirpath))
+            except OSError:
+                return None # zipped, perhaps. We can't tell what changed.
+            crossenv_files.extend(utils.file_identity(os.path.join(dirpath,
+                name)) for name in names if not name.endswith('.pyc'))
+
+        ensurepip = importlib.util.find_spec('ensurepip')
+        build_files = [
+            utils.file_identity(os.path.realpath(sys.executable)),
+            utils.file_identity(os.path.join(
+                os.path.dirname(ensurepip.origin), '_bundled'))
+            if ensurepip is not None else None,
+        ]
+        if self.build_system_site_packages:
+            build_files.extend(utils.file_identity(d)
+                    for d in site.getsitepackages())
+
+        config = (
+            __version__, crossenv_files,
+            sys.version, build_files,
+            self.host_identity, self.host_sysconfigdata_file,
+            self.host_project_base, self.host_home,
+            sorted(self.cross_build_time_vars().items()),
+            list(self.extra_env_vars),
+            self.host_sysroot, utils.file_identity(self.host_sysroot or ''),
+            self.host_machine, self.sysconfig_platform,
+            self.macosx_deployment_target,
+            sorted(self.platform_tags), self.effective_glibc,
+            self.launcher, self.single_file_bootstrap,
+            self.unchecked_hash_pycs,
+            self.with_build_pip, self.with_cross_pip,
+            self.build_system_site_packages,
+            self.installer.identity(), self.cross_installer.identity(),
+        )
+        name = hashlib.sha256(repr(config).encode(
+                'utf-8', 'surrogateescape')).hexdigest()[:32]
+        self._env_template = os.path.join(self.cache_dir, 'env-templates',
+                name)
+        return self._env_template
+
+    def find_env_template(self, env_dir):
+        """
+        Return the template to make env_dir from, or None if it should be
+        made from scratch. Templates are only used for new environments, in
+        paths that don't need quoting in shell scripts.
+
+        :param env_dir: The environment that's about to be made.
+        """
+
+        if self.cross_prefix or shlex.quote(env_dir) != env_dir:
+            return None
+        if os.path.exists(env_dir) and (not os.path.isdir(env_dir) or
+                os.listdir(env_dir)):
+            return None
+        path = self.env_template_path()
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, 'template.marshal'), 'rb') as fp:
+                info = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        info['path'] = os.path.join(path, 'env')
+        return info
+
+    def save_env_template(self, context):
+        """
+        Keep a copy of a freshly made environment as the template for later
+        ones. The copy is made under a temporary name and renamed into place,
+        so that it's never seen half-written, and only the first of several
+        environments made at once is kept.
+        """
+
+        path = self.env_template_path()
+        if (path is None or os.path.exists(path) or self.cross_prefix or
+                shlex.quote(context.env_dir) != context.env_dir):
+            return
+
+        info = {
+            'env_dir': context.env_dir,
+            'sentinel': context.sentinel,
+            'build_sys_path': context.build_sys_path,
+            'cross_python_info': context.cross_python_info,
+        }
+        tmp = '%s.tmp-%d-%d' % (path, os.getpid(), threading.get_ident())
+        try:
+            utils.mkdir_if_needed(tmp)
+            shutil.copytree(context.env_dir, os.path.join(tmp, 'env'),
+                    symlinks=True)
+            with open(os.path.join(tmp, 'template.marshal'), 'wb') as fp:
+                marshal.dump(info, fp)
+            os.rename(tmp, path)
+        except (OSError, ValueError) as e:
+            if not os.path.exists(path):
+                logger.warning("Cannot save environment template to %s: %s",
+                        path, e)
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+            return
+        logger.debug("Saved environment template to %s", path)
+
+    def create_from_template(self, env_dir, template):
+        """
+        Make an environment by copying a template of one made with the same
+        configuration, changing its paths on the way. What crossenv generates
+        itself, and the virtual environments' configuration and activate
+        scripts, are then written again in place, rather than patched.
+
+        :param env_dir:     The environment to make.
+        :param template:    The template, as from find_env_template().
+        """
+
+        logger.info("Copying environment template")
+        logger.debug("Template: %s", template['path'])
+        old_env_dir = template['env_dir']
+        context = self.ensure_directories(env_dir)
+        utils.copy_tree_replacing(template['path'], env_dir, old_env_dir,
+                env_dir)
+
+        self.locate_build_python(context)
+        self.locate_cross_python(context)
+        for env, venv_dir in (
+                (self.build_venv_builder(), context.build_env_dir),
+                (self.cross_venv_builder(context), context.cross_env_dir)):
+            venv_context = env.ensure_directories(venv_dir)
+            env.create_configuration(venv_context)
+            scripts = set(os.listdir(venv_context.bin_path))
+            env.setup_scripts(venv_context)
+            # Only rewrite the ones the template has, as for cross-python
+            for name in os.listdir(venv_context.bin_path):
+                if name not in scripts:
+                    utils.remove_path(os.path.join(venv_context.bin_path,
+                        name))
+        self.point_cross_venv_at_host(context)
+        self.copy_and_patch_sysconfigdata(context)
+
+        context.sentinel = template['sentinel']
+        context.build_sys_path = utils.replace_path(
+                template['build_sys_path'], old_env_dir, env_dir)
+        self.write_cross_python(context)
+        context.cross_python_info = utils.replace_path(
+                template['cross_python_info'], old_env_dir, env_dir)
+        self.save_config_vars_snapshot(context)
+        self.post_setup(context)
+
+    def create_all(self, env_dirs, jobs=1):
+        """
+        Create several cross virtual environments, up to jobs of them at
+        once. While more than one is being created, each one's log messages
+        are held back until it's done, so that they come out together, in the
+        order the environments were given.
+
+        :param env_dirs:    The directories to create environments in.
+        :param jobs:        How many environments to create at once.
+        :returns:           A list of (env_dir, exception) for each
+                            environment that couldn't be created, in the order
+                            they were given.
+        """
+
+        env_dirs = list(env_dirs)
+        failures = []
+        if jobs <= 1 or len(env_dirs) <= 1:
+            for env_dir in env_dirs:
+                try:
+                    self.create(env_dir, jobs=jobs)
+                except Exception as e:
+                    failures.append((env_dir, e))
+            return failures
+
+        def create(env_dir):
+            records = []
+            _log_capture.records = records
+            try:
+                self.create(env_dir, jobs=jobs)
+                return records, None
+            except Exception as e:
+                return records, e
+            finally:
+                _log_capture.records = None
+
+        capture = _CapturedLogFilter()
+        handlers = list(logging.getLogger().handlers)
+        for handler in handlers:
+            handler.addFilter(capture)
+        try:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                results = [pool.submit(create, env_dir)
+                           for env_dir in env_dirs]
+                for env_dir, result in zip(env_dirs, results):
+                    records, error = result.result()
+                    for record in records:
+                        logging.getLogger(record.name).handle(record)
+                    if error is not None:
+                        failures.append((env_dir, error))
+        finally:
+            for handler in handlers:
+                handler.removeFilter(capture)
+        return failures
 
     def ensure_directories(self, env_dir):
         """
@@ -522,6 +973,15 @@ class CrossEnvBuilder(venv.EnvBuilder):
         context = super().ensure_directories(env_dir)
         context.lib_path = os.path.join(env_dir, 'lib')
         context.exposed_libs = os.path.join(context.lib_path, 'exposed.txt')
+        context.exposed_index = os.path.join(context.lib_path,
+                'exposed-index.txt')
+        context.forkserver_socket = os.path.join(context.lib_path,
+                'forkserver.sock')
+        context.forkserver_pid_file = os.path.join(context.lib_path,
+                'forkserver.pid')
+        context.store_path = self.store.path if self.store else None
+        context.store_module = os.path.join(context.lib_path,
+                '_crossenv_store.py')
         utils.mkdir_if_needed(context.lib_path)
         return context
 
@@ -662,96 +1122,146 @@ class CrossEnvBuilder(venv.EnvBuilder):
         Assemble the build-python virtual environment
         """
 
-        context.build_env_dir = os.path.join(context.env_dir, 'build')
+        self.locate_build_python(context)
         logger.info("Creating build-python environment")
-        env = venv.EnvBuilder(
-                system_site_packages=self.build_system_site_packages,
-                clear=self.clear_build,
-                with_pip=self.with_build_pip,
-                symlinks=True)
+        env = self.build_venv_builder(clear=self.clear_build)
         env.create(context.build_env_dir)
-        context.build_bin_path = os.path.join(context.build_env_dir, 'bin')
-        context.build_env_exe = os.path.join(
-                context.build_bin_path, context.python_exe)
+        if self.with_build_pip:
+            self.installer.bootstrap_pip(context.build_env_exe)
 
-        # What is build-python's sys.path?
-        out = subprocess.check_output(
-                [context.build_env_exe,
-                    '-c',
-                    r"import sys; print('\n'.join(sys.path))"],
-                universal_newlines=True).splitlines()
-        context.build_sys_path = []
-        for line in out:
-            line = line.strip()
-            if line:
-                context.build_sys_path.append(line)
+        info = self.introspect_build_python(context)
+        context.build_sys_path = [p for p in info['sys_path'] if p]
 
         if self.with_build_pip:
             # Make sure we install the same version of pip and setuptools to
             # prevent errors (#1).
-            reqs = subprocess.check_output([context.build_env_exe, '-m', 'pip',
-                '--disable-pip-version-check',
-                'freeze',
-                '--all'],
-                universal_newlines=True)
-            all_reqs = reqs.split()
             context.build_pip_reqs = []
-            for req in all_reqs:
-                package = req.split('==')[0]
+            for package in ('pip', 'setuptools'):
+                version = info['versions'][package]
+                if version is None:
+                    continue
+                req = '%s==%s' % (package, version)
                 if package == 'pip':
                     context.build_pip_version = req
-                    context.build_pip_reqs.append(req)
-                elif package == 'setuptools':
-                    context.build_pip_reqs.append(req)
+                context.build_pip_reqs.append(req)
 
             # Many distributions use a patched, 'unbundled' version of pip,
             # where the vendored packages aren't stored within pip itself, but
             # elsewhere on the system. This breaks cross-pip, which won't be
             # able to find them after the modifications we made. Fix this by
             # downloading a stock version of pip (Issue #6).
-            if self._build_pip_is_unbundled(context):
+            if info['pip_unbundled']:
                 logger.info("Redownloading stock pip")
-                subprocess.check_output([context.build_env_exe, '-m', 'pip',
-                    '--disable-pip-version-check',
-                    'install',
-                    '--ignore-installed',
-                    context.build_pip_version])
+                self.installer.install(context.build_env_exe,
+                        [context.build_pip_version], reinstall=True)
 
-    def _build_pip_is_unbundled(self, context):
-        pyver = 'python' + sysconfig.get_config_var('py_version_short')
-        bundled_module = os.path.join(context.build_env_dir,
-                              'lib',
-                              pyver,
-                              'site-packages',
-                              'pip',
-                              '_vendor',
-                              'six.py')
-        return not os.path.exists(bundled_module)
+    def locate_build_python(self, context):
+        """
+        Fill in where build-python's virtual environment is
+        """
 
-    def make_cross_python(self, context):
+        context.build_env_dir = os.path.join(context.env_dir, 'build')
+        context.build_bin_path = os.path.join(context.build_env_dir, 'bin')
+        context.build_env_exe = os.path.join(
+                context.build_bin_path, context.python_exe)
+
+    def build_venv_builder(self, clear=False):
         """
-        Assemble the cross-python virtual environment
+        The venv.EnvBuilder for build-python's virtual environment
+        """
+
+        return venv.EnvBuilder(
+                system_site_packages=self.build_system_site_packages,
+                clear=clear,
+                with_pip=False, # see make_build_python
+                symlinks=True)
+
+    def introspect_build_python(self, context):
+        """
+        Ask build-python everything we need to know about it, all at once:
+        its sys.path, the versions of pip and setuptools it has, and whether
+        its pip has been unbundled. The versions come from the installed
+        metadata, so pip itself is never imported.
         """
 
+        pyver = 'python' + sysconfig.get_config_var('py_version_short')
+        bundled_module = os.path.join(context.build_env_dir, 'lib', pyver,
+                'site-packages', 'pip', '_vendor', 'six.py')
+        script = dedent('''\
+            import json, os, sys
+            try:
+                from importlib import metadata
+            except ImportError:
+                metadata = None
+
+            def version(name):
+                if metadata is not None:
+                    try:
+                        return metadata.version(name)
+                    except metadata.PackageNotFoundError:
+                        return None
+                # No importlib.metadata before 3.8. Look for the dist-info.
+                prefix = name + '-'
+                for entry in sys.path:
+                    try:
+                        names = os.listdir(entry or '.')
+                    except OSError:
+                        continue
+                    for dirname in names:
+                        if (dirname.startswith(prefix) and
+                                dirname.endswith('.dist-info')):
+                            return dirname[len(prefix):-len('.dist-info')]
+                return None
+
+            versions = {}
+            for name in ('pip', 'setuptools'):
+                versions[name] = version(name)
+            json.dump({
+                'sys_path': sys.path,
+                'versions': versions,
+                'pip_unbundled': (versions['pip'] is not None and
+                                  not os.path.exists(sys.argv[1])),
+            }, sys.stdout)
+            ''')
+        out = subprocess.check_output([context.build_env_exe, '-c', script,
+                bundled_module], universal_newlines=True)
+        return json.loads(out)
+
+    def make_cross_venv(self, context):
+        """
+        Create the virtual environment that cross-python will live in, and
+        the sysconfigdata it will use. None of this depends on build-python's
+        environment.
+        """
+
+        self.locate_cross_python(context)
         logger.info("Creating cross-python environment")
+        env = self.cross_venv_builder(context, clear=self.clear_cross)
+        env.create(context.cross_env_dir)
+
+        # Remove binaries. We'll run from elsewhere
+        for exe in os.listdir(context.cross_bin_path):
+            if not exe.startswith('activate'):
+                utils.remove_path(os.path.join(context.cross_bin_path, exe))
+
+        self.point_cross_venv_at_host(context)
+        self.copy_and_patch_sysconfigdata(context)
+
+    def locate_cross_python(self, context):
+        """
+        Fill in where cross-python's virtual environment is
+        """
+
         if self.cross_prefix:
             context.cross_env_dir = self.cross_prefix
         else:
             context.cross_env_dir = os.path.join(context.env_dir, "cross")
-        cross_env_name = os.path.split(context.env_dir)[-1]
-
-        env = venv.EnvBuilder(
-                system_site_packages=False,
-                clear=self.clear_cross,
-                symlinks=True,
-                upgrade=False,
-                with_pip=False,
-                prompt=cross_env_name)
-        env.create(context.cross_env_dir)
         context.cross_bin_path = os.path.join(context.cross_env_dir, 'bin')
         context.cross_lib_path = os.path.join(context.cross_env_dir, 'lib')
         context.cross_env_exe = os.path.join(
                 context.cross_bin_path, context.python_exe)
+        context.cross_exec_link = os.path.join(
+                context.cross_bin_path, '.' + context.python_exe)
         context.cross_cfg_path = os.path.join(context.cross_env_dir, 'pyvenv.cfg')
         context.cross_activate = os.path.join(context.cross_bin_path, 'activate')
 
@@ -759,12 +1269,25 @@ class CrossEnvBuilder(venv.EnvBuilder):
         context.cross_site_lib_path = os.path.join(context.cross_lib_path,
                 pyver, 'site-packages')
 
-        # Remove binaries. We'll run from elsewhere
-        for exe in os.listdir(context.cross_bin_path):
-            if not exe.startswith('activate'):
-                utils.remove_path(os.path.join(context.cross_bin_path, exe))
+    def cross_venv_builder(self, context, clear=False):
+        """
+        The venv.EnvBuilder for cross-python's virtual environment
+        """
+
+        cross_env_name = os.path.split(context.env_dir)[-1]
+        return venv.EnvBuilder(
+                system_site_packages=False,
+                clear=clear,
+                symlinks=True,
+                upgrade=False,
+                with_pip=False,
+                prompt=cross_env_name)
+
+    def point_cross_venv_at_host(self, context):
+        """
+        Make cross-python's pyvenv.cfg name host-python's home
+        """
 
-        # Alter pyvenv.cfg
         with utils.overwrite_file(context.cross_cfg_path) as out:
             with open(context.cross_cfg_path) as inp:
                 for line in inp:
@@ -772,6 +1295,128 @@ class CrossEnvBuilder(venv.EnvBuilder):
                         line = 'home = %s\n' % self.host_project_base
                     out.write(line)
 
+    def make_cross_python(self, context):
+        """
+        Assemble the cross-python virtual environment
+        """
+
+        context.sentinel = random.randint(0,0xffffffff)
+        self.write_cross_python(context)
+        self.snapshot_config_vars(context)
+
+        # cross-python is ready. We will use build-pip to install cross-pip
+        # because 'python -m ensurepip' is likely to get confused and think
+        # that there's nothing to do.
+        if self.with_cross_pip:
+            logger.info("Installing cross-pip")
+            if self.copy_build_pip(context):
+                return
+
+            # Make sure we install the same version of pip and setuptools to
+            logger.debug("Installing: %s", context.build_pip_reqs)
+            self.cross_installer.install(context.cross_env_exe,
+                    context.build_pip_reqs, prefix=context.cross_env_dir,
+                    reinstall=True)
+            self.fix_cross_scripts(context)
+
+    def fix_cross_scripts(self, context):
+        """
+        Give scripts that other installers than cross-pip put in cross-python's
+        bin directory the same shebang cross-pip would. uv, for one, names
+        the interpreter behind cross-python's launcher, which doesn't set
+        anything up.
+        """
+
+        shebang = utils.cross_script_shebang(context.cross_env_exe,
+                context.cross_launcher_body)
+        interps = (context.cross_env_exe, context.cross_exec_link)
+        for name in os.listdir(context.cross_bin_path):
+            path = os.path.join(context.cross_bin_path, name)
+            if utils.script_interpreter(path) not in interps:
+                continue
+            with open(path, 'rb') as fp:
+                if fp.read(len(shebang)) == shebang.encode():
+                    continue
+            logger.debug("Fixing shebang of %s", path)
+            utils.replace_shebang(path, shebang)
+
+    def copy_build_pip(self, context):
+        """
+        Give cross-python the same pip and setuptools as build-python, by
+        linking (or copying) the files their RECORDs list, rather than asking
+        pip to install them again. pip and setuptools are pure Python, so
+        they're the same for both. Their console scripts are written afresh,
+        to run cross-python.
+
+        :returns:   False if build-python's copies can't be found, in which
+                    case nothing has been done.
+        """
+
+        build_site = os.path.join(context.build_env_dir, 'lib',
+                'python' + sysconfig.get_config_var('py_version_short'),
+                'site-packages')
+        dist_infos = []
+        for req in getattr(context, 'build_pip_reqs', []):
+            name, version = req.split('==')
+            dist_info = os.path.join(build_site,
+                    '%s-%s.dist-info' % (name, version))
+            if not os.path.isfile(os.path.join(dist_info, 'RECORD')):
+                logger.debug("No %s in build-python; installing it", req)
+                return False
+            dist_infos.append(dist_info)
+        if not dist_infos:
+            return False
+
+        for dist_info in dist_infos:
+            logger.debug("Copying %s", os.path.basename(dist_info))
+            record_path = os.path.join(dist_info, 'RECORD')
+            with open(record_path, newline='') as fp:
+                record = [row for row in csv.reader(fp) if row]
+            console_scripts = utils.read_console_scripts(
+                    os.path.join(dist_info, 'entry_points.txt'))
+
+            for row in record:
+                name = row[0]
+                src = os.path.normpath(os.path.join(build_site, name))
+                dst = os.path.normpath(os.path.join(
+                        context.cross_site_lib_path, name))
+                if os.path.dirname(src) == context.build_bin_path:
+                    script = os.path.basename(src)
+                    entry_point = utils.find_console_script(console_scripts,
+                            script)
+                    if entry_point is not None:
+                        utils.write_console_script(dst, entry_point,
+                                context.cross_env_exe,
+                                context.cross_launcher_body)
+                        row[1:] = utils.record_hash(dst)
+                    continue
+                # The RECORD itself is written below. Bytecode names its
+                # source file, so cross-python writes its own.
+                if (src == record_path or
+                        os.path.commonpath([src, build_site]) != build_site or
+                        name.endswith('.pyc') or not os.path.isfile(src)):
+                    continue
+                utils.mkdir_if_needed(os.path.dirname(dst))
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+
+            # The scripts are different now
+            dst = os.path.join(context.cross_site_lib_path,
+                    os.path.relpath(record_path, build_site))
+            utils.mkdir_if_needed(os.path.dirname(dst))
+            with utils.overwrite_file(dst, perms=0o644) as fp:
+                csv.writer(fp).writerows(record)
+        return True
+
+    def write_cross_python(self, context):
+        """
+        Write cross-python's launcher, and the modules it uses to set itself
+        up. None of this starts a process, so it can be done again cheaply
+        when the environment's paths change.
+        """
+
         # make a script that sets the environment variables and calls Python.
         # Don't do this in bin/activate, because it's a pain to set/unset
         # properly (and for csh, fish as well).
@@ -790,14 +1435,6 @@ class CrossEnvBuilder(venv.EnvBuilder):
         # in our cross environment.. so we inject lib-dynload to the path also
         dynload = os.path.join(stdlib, "lib-dynload")
 
-        # In python 3.11, several system packages are frozen by default, which
-        # prevents us from patching it. Disable it.
-        xopt = subprocess.run([context.build_env_exe, "--help-xoptions"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        disable_frozen_modules = (b'frozen_modules=' in xopt.stdout)
-
-        context.sentinel = random.randint(0,0xffffffff)
-
         extra_envs = list(self.extra_env_vars)
 
         # Add sysroot to various environment variables. This doesn't help
@@ -826,24 +1463,56 @@ class CrossEnvBuilder(venv.EnvBuilder):
             else:
                 extra_envs.insert(0, ('CPATH', ':=', inc))
 
+        # Where cross-python will find the stdlib. This is what
+        # sysconfig.get_path('stdlib') says at runtime, since both use
+        # build-python's install scheme.
+        cross_stdlib = sysconfig.get_path('stdlib', vars={
+            'installed_base': self.host_home,
+            'base': self.host_home,
+        })
+
         # Put a few things in locals to make templating marginally less gross
         macosx_deployment_target = self.macosx_deployment_target
         host_sysconfigdata = self.host_sysconfigdata
         host_build_time_vars = self.host_sysconfigdata.build_time_vars
         sysconfig_name = self.host_sysconfigdata_name
 
-
-        # Install patches to environment
-        self.copy_and_patch_sysconfigdata(context)
-
         tmpl = utils.TemplateContext()
         tmpl.update(locals())
 
-        utils.install_script('pywrapper.py.tmpl', context.cross_env_exe, tmpl)
+        if self.launcher == 'sh':
+            # build-python must think that it lives in the cross venv. The
+            # shell can't set argv[0], so exec it through a symlink there.
+            utils.symlink(context.build_env_exe, context.cross_exec_link)
+            tmpl.update_globals({'quote': shlex.quote})
+            tmpl.update({
+                'pythonpath': os.pathsep.join([context.lib_path, stdlib,
+                                               dynload]),
+                'extra_env_commands': utils.shell_env_commands(extra_envs),
+                'forkclient_code': 'import sys; sys.path.insert(0, %r); '
+                    'import _crossenv_forkclient; '
+                    '_crossenv_forkclient.main()' % context.lib_path,
+            })
+            launcher_src = utils.expand_script('pywrapper.sh.tmpl', tmpl)
+            utils.write_script(launcher_src, context.cross_env_exe)
+
+            # Scripts that run cross-python can carry a copy of this, rather
+            # than exec'ing it. Console scripts keep it in a docstring.
+            body = launcher_src.split('\n', 1)[1]
+            if "'''" in body or '\\' in body:
+                context.cross_launcher_body = None
+            else:
+                context.cross_launcher_body = body
+            utils.install_script('_crossenv_forkclient.py.tmpl',
+                    os.path.join(context.lib_path, '_crossenv_forkclient.py'),
+                    tmpl)
+        else:
+            utils.install_script('pywrapper.py.tmpl', context.cross_env_exe,
+                    tmpl)
+            context.cross_launcher_body = None
 
         # Everything in lib_path follows the same pattern
-        site_scripts = [
-            'site.py',
+        patch_scripts = [
             'sys-patch.py',
             'os-patch.py',
             'importlib-machinery-patch.py',
@@ -853,11 +1522,41 @@ class CrossEnvBuilder(venv.EnvBuilder):
             'subprocess-patch.py',
             'distutils-sysconfig-patch.py',
             'pip-_vendor-distlib-scripts-patch.py',
+            'pip-_internal-operations-install-wheel-patch.py',
             'pkg_resources-patch.py',
             'packaging-tags-patch.py',
         ]
 
-        for script in site_scripts:
+        patch_sources = {}
+        for script in patch_scripts:
+            dst = os.path.join(context.lib_path, script)
+            patch_sources[dst] = utils.expand_script(script + '.tmpl', tmpl)
+
+        # Compile the patches once, rather than in every cross-python process.
+        # The bootstrap checks the key to make sure the cache is current.
+        patch_cache = utils.compile_code_cache(patch_sources)
+        patch_cache_path = os.path.join(context.lib_path, 'patches.marshal')
+        context.patch_cache_hash = patch_cache[0][1]
+        if self.single_file_bootstrap:
+            context.patch_cache = None
+            context.embedded_patch_cache = pprint.pformat(patch_cache)
+            context.embedded_patch_sources = pprint.pformat(
+                    {os.path.basename(k): v for k, v in patch_sources.items()})
+            # Don't leave anything from a previous run lying around
+            for path in list(patch_sources) + [patch_cache_path]:
+                if os.path.exists(path):
+                    os.unlink(path)
+        else:
+            context.patch_cache = patch_cache_path
+            context.embedded_patch_cache = None
+            context.embedded_patch_sources = {}
+            for dst, src in patch_sources.items():
+                utils.write_script(src, dst)
+            with utils.overwrite_file(context.patch_cache, 'wb',
+                    perms=0o644) as fp:
+                marshal.dump(patch_cache, fp)
+
+        for script in ['site.py', '_crossenv_bootstrap.py']:
             src = script + '.tmpl'
             dst = os.path.join(context.lib_path, script)
             utils.install_script(src, dst, tmpl)
@@ -866,39 +1565,50 @@ class CrossEnvBuilder(venv.EnvBuilder):
                 os.path.join(context.cross_site_lib_path, '_manylinux.py'),
                 tmpl)
 
+        # cross-pip uses this to put what it installs in the store
+        if self.store:
+            utils.write_script(
+                    pkgutil.get_data(__package__, 'store.py').decode(),
+                    context.store_module, perms=0o644)
+        elif os.path.exists(context.store_module):
+            os.unlink(context.store_module)
+
+        # In python 3.11, several system packages are frozen by default,
+        # including site, so our site.py is never imported. Rather than
+        # disabling frozen modules, which slows down startup considerably, set
+        # up cross-python from a .pth file when the real site module runs.
+        utils.install_script('_crossenv.pth.tmpl',
+                os.path.join(context.cross_site_lib_path, '_crossenv.pth'),
+                tmpl, perms=0o644)
+
+        # Compile the modules we generated now. If the environment ends up
+        # read-only, nothing else will, and every process would compile them
+        # again. sysconfigdata in particular is large.
+        generated = [
+            context.cross_sysconfig,
+            os.path.join(context.lib_path, 'site.py'),
+            os.path.join(context.lib_path, '_crossenv_bootstrap.py'),
+            os.path.join(context.cross_site_lib_path, '_manylinux.py'),
+        ]
+        if self.launcher == 'sh':
+            generated.append(os.path.join(context.lib_path,
+                    '_crossenv_forkclient.py'))
+        for path in generated:
+            utils.compile_module(path, self.unchecked_hash_pycs)
+
         # Symlink alternate names to our wrapper
         for exe in ('python', 'python3'):
             exe = os.path.join(context.cross_bin_path, exe)
             if not os.path.exists(exe):
                 utils.symlink(context.python_exe, exe)
 
-        # cross-python is ready. We will use build-pip to install cross-pip
-        # because 'python -m ensurepip' is likely to get confused and think
-        # that there's nothing to do.
-        if self.with_cross_pip:
-            logger.info("Installing cross-pip")
-
-            # Make sure we install the same version of pip and setuptools to
-            logger.debug("Installing: %s", context.build_pip_reqs)
-            subprocess.check_output([context.cross_env_exe, '-m', 'pip',
-                '--disable-pip-version-check',
-                'install',
-                '--ignore-installed',
-                '--prefix='+context.cross_env_dir] + context.build_pip_reqs)
-
 
-    def copy_and_patch_sysconfigdata(self, context):
+    def cross_build_time_vars(self):
         """
-        Put sysconfigdata file in the crossenv/lib directory. We will
-        transform CC, CXX, and related variables as requested.
+        The build_time_vars that cross-python's sysconfigdata will hold: the
+        host's, with CC, etc. transformed as requested.
         """
 
-        sysconfig_name = os.path.basename(self.host_sysconfigdata_file)
-        # we always write a .py, but we might be reading from a .pyc
-        # (i.e., from buildroot).
-        sysconfig_name = self.host_sysconfigdata_name + '.py'
-        context.cross_sysconfig = os.path.join(context.lib_path, sysconfig_name)
-
         # Patch all instances of CC, etc. We'll do a global search and
         # replace
         host_cc = self.real_host_cc[0]
@@ -915,14 +1625,8 @@ class CrossEnvBuilder(venv.EnvBuilder):
         find_ar = re.compile(r'(?:^|(?<=\s))%s(?=\s|$)' % re.escape(host_ar))
         find_prefix = re.compile(r'(?:^|(?<=\s))%s' % re.escape(host_prefix))
 
-        cross_sysconfig_data = {}
-        for key, value in self.host_sysconfigdata.__dict__.items():
-            if key.startswith('__'):
-                continue # misc module stuff like __name__, __builtins__
-            cross_sysconfig_data[key] = value
-
         build_time_vars = {}
-        for key, value in cross_sysconfig_data['build_time_vars'].items():
+        for key, value in self.host_sysconfigdata.build_time_vars.items():
             if isinstance(value, str):
                 value = find_ar.sub(repl_ar, value)
                 value = find_cxx.sub(repl_cxx, value)
@@ -942,14 +1646,197 @@ class CrossEnvBuilder(venv.EnvBuilder):
         for key, value in self.host_config_vars.items():
             build_time_vars[key] = value
 
-        cross_sysconfig_data['build_time_vars'] = build_time_vars
+        return build_time_vars
+
+    def copy_and_patch_sysconfigdata(self, context):
+        """
+        Put sysconfigdata file in the crossenv/lib directory. We will
+        transform CC, CXX, and related variables as requested.
+        """
+
+        sysconfig_name = os.path.basename(self.host_sysconfigdata_file)
+        # we always write a .py, but we might be reading from a .pyc
+        # (i.e., from buildroot).
+        sysconfig_name = self.host_sysconfigdata_name + '.py'
+        context.cross_sysconfig = os.path.join(context.lib_path, sysconfig_name)
+
+        # The resolved snapshot is taken once cross-python works. Until then,
+        # an old one must not be used.
+        context.config_vars_snapshot = os.path.join(context.lib_path,
+                'config_vars.marshal')
+        if os.path.exists(context.config_vars_snapshot):
+            os.unlink(context.config_vars_snapshot)
 
-        with open(context.cross_sysconfig, 'w') as fp:
+        cross_sysconfig_data = {}
+        for key, value in self.host_sysconfigdata.__dict__.items():
+            if key.startswith('__'):
+                continue # misc module stuff like __name__, __builtins__
+            cross_sysconfig_data[key] = value
+
+        cross_sysconfig_data['build_time_vars'] = self.cross_build_time_vars()
+
+        with utils.overwrite_file(context.cross_sysconfig, perms=0o644) as fp:
             fp.write("# generated from %s\n" % self.host_sysconfigdata_file)
             for key, value in cross_sysconfig_data.items():
                 fp.write("%s = " % key)
                 pprint.pprint(value, stream=fp, compact=True)
 
+    def snapshot_config_vars(self, context):
+        """
+        Save what sysconfig.get_config_vars() returns in cross-python, so that
+        cross-python processes can use it without working it all out again.
+        The derived variables depend on how cross-python sets itself up, so
+        the easiest way to get them right is to ask it. While we're there,
+        collect what cross-python-config needs to know.
+        """
+
+        script = dedent('''\
+            import marshal, sys, sysconfig
+            try:
+                from packaging import tags
+            except ImportError:
+                try:
+                    from pip._vendor.packaging import tags
+                except ImportError:
+                    tags = None
+            info = {
+                'config_vars': dict(sysconfig.get_config_vars()),
+                'paths': sysconfig.get_paths(),
+                'platform': sysconfig.get_platform(),
+                'platform_tags': list(tags.platform_tags()) if tags else None,
+                'darwin': sys.platform == 'darwin',
+            }
+            sys.stdout.buffer.write(marshal.dumps(info))
+            ''')
+        context.cross_python_info = None
+        try:
+            out = subprocess.check_output([context.cross_env_exe, '-c',
+                script])
+            info = marshal.loads(out)
+        except (OSError, subprocess.CalledProcessError, ValueError,
+                EOFError) as e:
+            logger.warning("Could not snapshot cross-python's config vars: %s",
+                    e)
+            return
+
+        context.cross_python_info = info
+        self.save_config_vars_snapshot(context)
+
+    def save_config_vars_snapshot(self, context):
+        """
+        Write the config vars from context.cross_python_info where
+        cross-python will look for them.
+        """
+
+        info = context.cross_python_info
+        if info is None:
+            return
+
+        # On macOS hosts, _osx_support adjusts the variables based on the
+        # environment, so don't save them.
+        if not info['darwin']:
+            with utils.overwrite_file(context.config_vars_snapshot, 'wb',
+                    perms=0o644) as fp:
+                marshal.dump(info['config_vars'], fp)
+
+    def install_python_config(self, context):
+        """
+        Write cross-python-config, which answers the usual python3-config
+        questions, and a few more, from what cross-python told us when it was
+        created. It's a shell script, so that build systems that ask it many
+        questions don't start cross-python each time.
+        """
+        info = context.cross_python_info
+        dst = os.path.join(context.bin_path, 'cross-python-config')
+        if info is None:
+            logger.warning("Not installing cross-python-config")
+            if os.path.exists(dst):
+                os.unlink(dst)
+            return
+
+        config_vars = info['config_vars']
+        def getvar(name):
+            value = config_vars.get(name)
+            return '' if value is None else str(value)
+
+        # As python-config.py works them out
+        includes = ['-I' + info['paths']['include'],
+                    '-I' + info['paths']['platinclude']]
+        libs = getvar('LIBS').split() + getvar('SYSLIBS').split()
+        libs_embed = (['-lpython' + getvar('VERSION') + getvar('ABIFLAGS')]
+                      + libs)
+        if getvar('LIBPYTHON'):
+            libs.insert(0, getvar('LIBPYTHON'))
+        ldflags_prefix = []
+        if not config_vars.get('Py_ENABLE_SHARED'):
+            ldflags_prefix.append('-L' + getvar('LIBPL'))
+
+        platform_tags = info['platform_tags']
+        if platform_tags is None:
+            platform_tags = [re.sub(r'[-.]', '_', info['platform'])]
+
+        answers = {
+            'prefix': getvar('prefix'),
+            'exec-prefix': getvar('exec_prefix'),
+            'includes': ' '.join(includes),
+            'cflags': ' '.join(includes + getvar('CFLAGS').split()),
+            'libs': ' '.join(libs),
+            'libs-embed': ' '.join(libs_embed),
+            'ldflags': ' '.join(ldflags_prefix + libs),
+            'ldflags-embed': ' '.join(ldflags_prefix + libs_embed),
+            'extension-suffix': getvar('EXT_SUFFIX'),
+            'abiflags': getvar('ABIFLAGS'),
+            'configdir': getvar('LIBPL'),
+            'soabi': getvar('SOABI'),
+            'platform': info['platform'],
+            'platform-tags': '\n'.join(platform_tags),
+        }
+        dump = dict(answers)
+        dump['platform-tags'] = platform_tags
+        dump['paths'] = info['paths']
+        dump['config-vars'] = config_vars
+
+        config_var_cases = []
+        for name, value in sorted(config_vars.items()):
+            if value is None:
+                continue
+            config_var_cases.append('    %s) printf \'%%s\\n\' %s ;;' % (
+                shlex.quote(name), shlex.quote(str(value))))
+
+        tmpl = utils.TemplateContext()
+        tmpl.update_globals({'quote': shlex.quote})
+        tmpl.update({
+            'answers': answers,
+            'json_dump': json.dumps(dump, sort_keys=True, default=str),
+            'config_var_cases': '\n'.join(config_var_cases),
+        })
+        utils.install_script('cross-python-config.sh.tmpl', dst, tmpl)
+
+    def install_uv_commands(self, context):
+        """
+        Add build-uv and cross-uv, which run uv for build-python and
+        cross-python, if uv is what we're installing packages with.
+        """
+
+        uv = self.installer
+        if not isinstance(uv, installers.UvInstaller):
+            return
+        build_python = shlex.quote(context.build_env_exe)
+        uv_exe = shlex.quote(uv.uv)
+        utils.write_script(dedent(F('''\
+                #!/bin/sh
+                UV_PYTHON=%(build_python)s exec %(uv_exe)s "$@"
+                ''', locals())), os.path.join(context.bin_path, 'build-uv'))
+
+        if self.cross_installer is not uv:
+            return
+        shebang = utils.cross_script_shebang(context.cross_env_exe,
+                context.cross_launcher_body)
+        tmpl = utils.TemplateContext()
+        tmpl.update(locals())
+        utils.install_script('cross-uv.py.tmpl',
+                os.path.join(context.bin_path, 'cross-uv'), tmpl)
+
     def post_setup(self, context):
         """
         Extra processing. Put scripts/binaries in the right place.
@@ -960,18 +1847,41 @@ class CrossEnvBuilder(venv.EnvBuilder):
         utils.install_script('cross-expose.py.tmpl',
                 os.path.join(context.bin_path, 'cross-expose'),
                 tmpl)
+        utils.install_script('cross-trace-merge.py.tmpl',
+                os.path.join(context.bin_path, 'cross-trace-merge'),
+                tmpl)
+        self.install_python_config(context)
+        self.install_uv_commands(context)
+        if self.launcher == 'sh':
+            tmpl.update_globals({'quote': shlex.quote})
+            utils.install_script('cross-forkserver.py.tmpl',
+                    os.path.join(context.bin_path, 'cross-forkserver'),
+                    tmpl)
 
         # Don't trust these to be symlinks. A symlink to Python will mess up
         # the virtualenv.
 
         # Add cross-python alias to the path. This is just for
-        # convenience and clarity.
+        # convenience and clarity. Where we can, set up cross-python in the
+        # alias itself, rather than going through another launcher.
+        cross_python = os.path.realpath(context.cross_env_exe)
         for exe in os.listdir(context.cross_bin_path):
+            if exe.startswith('.'):
+                continue # internal, such as the launcher's exec link
             target = os.path.join(context.cross_bin_path, exe)
             if not os.path.isfile(target) or not os.access(target, os.X_OK):
                 continue
             dest = os.path.join(context.bin_path, 'cross-' + exe)
-            utils.make_launcher(target, dest)
+            interp = utils.script_interpreter(target)
+            if context.cross_launcher_body is None:
+                utils.make_launcher(target, dest)
+            elif os.path.realpath(target) == cross_python:
+                utils.make_inline_launcher(context.cross_launcher_body, dest)
+            elif interp and os.path.realpath(interp) == cross_python:
+                utils.make_inline_launcher(context.cross_launcher_body, dest,
+                        script=target)
+            else:
+                utils.make_launcher(target, dest)
 
         # Add build-python and build-pip to the path.
         for exe in os.listdir(context.build_bin_path):
@@ -1039,10 +1949,22 @@ def parse_config_vars(config_vars):
 
 
 def main():
+    if sys.argv[1:2] in (['pack'], ['unpack']):
+        from . import pack
+        pack.main(sys.argv[1:])
+        return
+    if sys.argv[1:2] == ['store']:
+        from . import store
+        store.main(sys.argv[2:])
+        return
+
     import argparse
     parser = argparse.ArgumentParser(description="""
                 Create virtual Python environments for cross compiling
-                """)
+                """,
+        epilog="""To move an environment somewhere else, see 'crossenv pack
+                --help' and 'crossenv unpack --help'. To manage a --store, see
+                'crossenv store --help'.""")
 
     parser.add_argument('--cross-prefix', action='store',
         help="""Specify the directory where cross-python files will be stored.
@@ -1130,6 +2052,53 @@ def main():
     parser.add_argument('--machine', action='store',
         help="""Override the value of os.uname().machine if cross-python is
                 unable to guess correctly.""")
+    parser.add_argument('--launcher', action='store', default='sh',
+        choices=['sh', 'python'],
+        help="""How cross-python sets up its environment before running
+                build-python. 'sh' (the default) uses a shell script that execs
+                build-python directly. 'python' uses a Python script, which
+                costs an extra interpreter startup on every run.""")
+    parser.add_argument('--single-file-bootstrap', action='store_true',
+        help="""Embed all of cross-python's patches in a single bootstrap
+                module, rather than separate files. This minimizes the number
+                of files cross-python touches on startup, which helps on slow
+                filesystems.""")
+    parser.add_argument('--unchecked-hash-pycs', action='store_true',
+        help="""Write bytecode for the modules crossenv generates as
+                unchecked-hash .pyc files, so that they are never recompiled,
+                even if the environment is read-only or has been moved.
+                Requires Python 3.7 or later.""")
+    parser.add_argument('--no-host-cache', action='store_true',
+        help="""Don't use or update the cache of what crossenv has learned
+                about host-python and the cross-compiler. By default it's kept
+                in ~/.cache/crossenv, and used until one of the files it came
+                from changes.""")
+    parser.add_argument('--refresh-host-cache', action='store_true',
+        help="""Ask host-python and the cross-compiler again, even if the
+                answers are cached, and cache the new answers.""")
+    parser.add_argument('--store', action='store',
+        help="""Share the environment's files with other environments through
+                a store in this directory, by hard links. Whatever cross-pip
+                installs later is shared too. The store must be on the same
+                filesystem as the environments. See 'crossenv store --help'.""")
+    parser.add_argument('--installer', choices=installers.INSTALLERS,
+        default='pip',
+        help="""What to install packages with while making the environment.
+                'auto' uses uv if it's on PATH (or named by $CROSSENV_UV), and
+                pip otherwise. uv is much faster, but is only used for
+                cross-python when no platform tags are given, since it can't
+                choose packages by them. With uv, the environment also gets
+                build-uv and cross-uv commands, which run uv for build-python
+                and cross-python. (default: %(default)s)""")
+    parser.add_argument('--env-cache', action='store_true',
+        help="""Keep a copy of the first environment made with each
+                configuration in ~/.cache/crossenv, and make later ones with
+                --env-cache by copying it, rather than from scratch.""")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+        help="""Create up to this many environments at once, when more than
+                one ENV_DIR is given, and overlap the independent parts of
+                creating each one. Each environment's messages are shown
+                together once it's finished.""")
     parser.add_argument('-v', '--verbose', action='count', default=0,
         help="""Verbose mode. May be specified multiple times to increase
                 verbosity.""")
@@ -1143,14 +2112,7 @@ def main():
         help="""A directory to create the environment in.""")
 
     args = parser.parse_args()
-
-    if args.verbose == 1:
-        level = logging.INFO
-    elif args.verbose > 1:
-        level = logging.DEBUG
-    else:
-        level = logging.WARNING
-    logging.basicConfig(level=level, format='%(levelname)s: %(message)s')
+    utils.configure_logging(args.verbose)
 
     try:
         if args.without_pip:
@@ -1175,9 +2137,25 @@ def main():
                 manylinux_tags=args.manylinux,
                 platform_tags=args.platform_tag,
                 host_machine=args.machine,
+                launcher=args.launcher,
+                single_file_bootstrap=args.single_file_bootstrap,
+                unchecked_hash_pycs=args.unchecked_hash_pycs,
+                host_cache=not args.no_host_cache,
+                refresh_host_cache=args.refresh_host_cache,
+                env_cache=args.env_cache,
+                store=args.store,
+                installer=args.installer,
                 )
-        for env_dir in args.ENV_DIR:
-            builder.create(env_dir)
+        if args.jobs > 1:
+            failures = builder.create_all(args.ENV_DIR, jobs=args.jobs)
+            for env_dir, e in failures:
+                logger.error('%s: %s', env_dir, e)
+                logger.debug('Traceback:', exc_info=e)
+            if failures:
+                sys.exit(1)
+        else:
+            for env_dir in args.ENV_DIR:
+                builder.create(env_dir)
     except Exception as e:
         logger.error('%s', e)
         logger.debug('Traceback:', exc_info=True)
@@ -0,0 +1,295 @@
+"""
+Answer the questions cross-python would, without starting it.
+"""
+
+import collections
+import contextlib
+import os
+import platform
+import sys
+import sysconfig
+
+_missing = object()
+
+# Tools that should see the host's glibc version. See os-patch.py.tmpl.
+_fake_glibc_callers = frozenset([
+    'pip', 'packaging', 'setuptools', 'pkg_resources', 'wheel', 'distlib',
+    '_manylinux'])
+
+_platform_uname_result = collections.namedtuple('uname_result',
+        'system node release version machine processor')
+_ios_version_info = collections.namedtuple('IOSVersionInfo',
+        'system release model is_simulator')
+
+
+def _import_packaging_tags():
+    try:
+        from packaging import tags
+    except ImportError:
+        try:
+            from pip._vendor.packaging import tags
+        except ImportError:
+            tags = None
+    return tags
+
+
+@contextlib.contextmanager
+def _patched_attributes(patches):
+    """
+    Set attributes for the duration of the context, and put them back
+    afterwards. Setting an attribute to _missing deletes it.
+
+    :param patches: An iterable of (object, name, value).
+    """
+    saved = []
+    try:
+        for obj, name, value in patches:
+            saved.append((obj, name, getattr(obj, name, _missing)))
+            if value is _missing:
+                if hasattr(obj, name):
+                    delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+        yield
+    finally:
+        for obj, name, value in reversed(saved):
+            if value is _missing:
+                if hasattr(obj, name):
+                    delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+
+
+class CrossEmulation:
+    """
+    What cross-python reports about the host, worked out in-process from what
+    a CrossEnvBuilder already knows. Nothing needs to have been created with
+    the builder, and nothing here starts a process, so it's cheap to ask many
+    questions about many hosts.
+
+    patched() goes a step further, and makes this interpreter report the host
+    the same way cross-python's patches do, until the context exits. The
+    patches are process-wide, so don't use them while other threads might be
+    asking the same questions about the build machine.
+
+    :param builder: The CrossEnvBuilder to take the host's details from.
+    """
+
+    def __init__(self, builder):
+        self.sys_platform = builder.host_sys_platform
+        self.machine = builder.host_machine
+        self.effective_glibc = builder.effective_glibc
+        self.build_time_vars = builder.cross_build_time_vars()
+
+        self._sysconfig_platform = builder.sysconfig_platform
+        self._sysconfigdata_name = builder.host_sysconfigdata_name
+        self._makefile = builder.host_makefile
+        self._uname = (builder.host_sysname, 'build', builder.host_release,
+                '', builder.host_machine)
+        self._platform_uname = _platform_uname_result(builder.host_system,
+                'build', builder.host_release, '', builder.host_machine,
+                builder.host_machine)
+        self._macosx_deployment_target = builder.macosx_deployment_target
+        self._ios_version = _ios_version_info(builder.host_system,
+                builder.host_release,
+                'iPhone' if builder.host_is_simulator else 'iPhone13,2',
+                builder.host_is_simulator)
+        self._platform_tags = list(builder.platform_tags)
+        self._config_vars = None
+
+    @classmethod
+    def for_host(cls, host_python, **kwargs):
+        """
+        Emulate a host without a cross-compiler at hand.
+
+        :param host_python: Path to the host Python executable.
+        :param kwargs:      Other arguments to CrossEnvBuilder, such as
+                            platform_tags or host_config_vars.
+        """
+        from . import CrossEnvBuilder
+        kwargs.setdefault('check_compiler', False)
+        return cls(CrossEnvBuilder(host_python=host_python, **kwargs))
+
+    def get_platform(self):
+        """sysconfig.get_platform()"""
+        return self._sysconfig_platform
+
+    def get_config_vars(self, *args):
+        """
+        sysconfig.get_config_vars(). Variables that describe an installation,
+        like prefix, are worked out for this interpreter, since there's no
+        cross-python here to describe.
+        """
+        if self._config_vars is None:
+            with self.patched():
+                self._config_vars = dict(sysconfig.get_config_vars())
+        if args:
+            return [self._config_vars.get(name) for name in args]
+        return dict(self._config_vars)
+
+    def get_config_var(self, name):
+        """sysconfig.get_config_var()"""
+        return self.get_config_vars(name)[0]
+
+    def uname(self):
+        """os.uname()"""
+        return os.uname_result(self._uname)
+
+    def platform_uname(self):
+        """platform.uname()"""
+        return self._platform_uname
+
+    def platform_tags(self):
+        """
+        packaging.tags.platform_tags(), as a list. Returns None if neither
+        packaging nor pip is available to ask.
+        """
+        tags = _import_packaging_tags()
+        if tags is None:
+            return None
+        with self.patched():
+            return list(tags.platform_tags())
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) with the patches applied, and return its
+        result.
+        """
+        with self.patched():
+            return func(*args, **kwargs)
+
+    @contextlib.contextmanager
+    def patched(self):
+        """
+        Apply cross-python's patches to sys, os, platform, sysconfig,
+        distutils.sysconfig, and packaging.tags until the context exits. Only
+        modules that are already imported are patched.
+        """
+        with _patched_attributes(self._sys_patches()), \
+                _patched_attributes(self._os_patches()), \
+                _patched_attributes(self._platform_patches()), \
+                _patched_attributes(self._sysconfig_patches()), \
+                _patched_attributes(self._packaging_patches()):
+            # distutils keeps its own copy of the config vars
+            patches = []
+            for name in ('distutils.sysconfig',
+                         'setuptools._distutils.sysconfig'):
+                module = sys.modules.get(name)
+                if module is not None and hasattr(module, '_config_vars'):
+                    config_vars = dict(sysconfig.get_config_vars())
+                    patches.append((module, '_config_vars', config_vars))
+            with _patched_attributes(patches):
+                yield
+
+    def _sys_patches(self):
+        abiflags = self.build_time_vars.get('ABIFLAGS')
+        multiarch = self.build_time_vars.get('MULTIARCH')
+        return [
+            (sys, 'cross_compiling', True),
+            (sys, 'platform', self.sys_platform),
+            (sys, 'abiflags', _missing if abiflags is None else abiflags),
+            (sys.implementation, '_multiarch',
+                _missing if multiarch is None else multiarch),
+        ]
+
+    def _os_patches(self):
+        result = os.uname_result(self._uname)
+        def uname():
+            return result
+        patches = [(os, 'uname', uname)]
+
+        if hasattr(os, 'confstr'):
+            original_confstr = os.confstr
+            glibc = self.effective_glibc
+            def confstr(name):
+                if name == 'CS_GNU_LIBC_VERSION':
+                    caller = sys._getframe(1).f_globals.get('__name__') or ''
+                    if not _fake_glibc_callers.isdisjoint(caller.split('.')):
+                        if glibc is None:
+                            return 'unknown 0.0'
+                        return 'glibc %d.%d' % glibc
+                return original_confstr(name)
+            patches.append((os, 'confstr', confstr))
+        return patches
+
+    def _platform_patches(self):
+        uname_result = self._platform_uname
+        ios_version = self._ios_version
+        macosx_deployment_target = self._macosx_deployment_target
+
+        def uname():
+            return uname_result
+
+        def libc_ver(*args, **kwargs):
+            return ('', '')
+
+        def mac_ver(release='', versioninfo=('', '', ''), machine=''):
+            if release == '':
+                release = macosx_deployment_target
+            if machine == '':
+                machine = uname_result.machine
+            return release, versioninfo, machine
+
+        def ios_ver(system='', release='', model='', is_simulator=False):
+            return ios_version
+
+        patches = [
+            (platform, 'uname', uname),
+            (platform, 'libc_ver', libc_ver),
+            (platform, 'mac_ver', mac_ver),
+        ]
+        if hasattr(platform, 'ios_ver'):
+            patches.append((platform, 'ios_ver', ios_ver))
+        if hasattr(platform, '_platform_cache'):
+            patches.append((platform, '_platform_cache', {}))
+        return patches
+
+    def _sysconfig_patches(self):
+        build_time_vars = self.build_time_vars
+        sysconfig_platform = self._sysconfig_platform
+        sysconfigdata_name = self._sysconfigdata_name
+        makefile = self._makefile
+
+        # sysconfig works everything else out from these when it's asked
+        # again.
+        def _init_posix(vars):
+            vars.update(build_time_vars)
+
+        def get_platform():
+            return sysconfig_platform
+
+        def _get_sysconfigdata_name():
+            return sysconfigdata_name
+
+        def get_makefile_filename():
+            return makefile
+
+        patches = [
+            (sysconfig, '_CONFIG_VARS', None),
+            (sysconfig, '_init_posix', _init_posix),
+            (sysconfig, 'get_platform', get_platform),
+            (sysconfig, '_get_sysconfigdata_name', _get_sysconfigdata_name),
+            (sysconfig, 'get_makefile_filename', get_makefile_filename),
+        ]
+        if hasattr(sysconfig, '_CONFIG_VARS_INITIALIZED'):
+            patches.append((sysconfig, '_CONFIG_VARS_INITIALIZED', False))
+        return patches
+
+    def _packaging_patches(self):
+        platform_tags = self._platform_tags
+        machine = self.machine
+
+        patches = []
+        for name in ('packaging.tags', 'pip._vendor.packaging.tags'):
+            tags = sys.modules.get(name)
+            if tags is None:
+                continue
+
+            # See packaging-tags-patch.py.tmpl
+            def _linux_platforms(is_32bit=None, tags=tags):
+                yield from platform_tags
+                arch = tags._normalize_string(machine)
+                archs = {"armv8l": ["armv8l", "armv7l"]}.get(arch, [arch])
+                yield from archs
+            patches.append((tags, '_linux_platforms', _linux_platforms))
+        return patches
@@ -0,0 +1,170 @@
+"""
+The programs crossenv installs packages with: pip, which is always at hand,
+or uv, which is much faster, if it can be found.
+"""
+
+import glob
+import importlib.util
+import logging
+import os
+import shlex
+import shutil
+import subprocess
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+INSTALLERS = ('pip', 'uv', 'auto')
+
+class Installer:
+    """
+    Installs packages into build-python's or cross-python's environment, by
+    running some other program.
+    """
+
+    name = None
+
+    def command(self, python, requirements, prefix=None, reinstall=False,
+            options=()):
+        """The command line that install() runs"""
+        raise NotImplementedError
+
+    def install(self, python, requirements, prefix=None, reinstall=False,
+            options=()):
+        """
+        Install packages for an interpreter.
+
+        :param python:          The interpreter to install for. Packages go in
+                                its environment, unless prefix is given.
+        :param requirements:    Requirement specifiers, or paths to wheels.
+        :param prefix:          Install under this prefix instead, as 'pip
+                                install --prefix' does.
+        :param reinstall:       If True, install the requirements even if
+                                they're installed already.
+        :param options:         Other options, such as --no-index, that both
+                                pip and uv understand.
+        """
+
+        cmd = self.command(python, requirements, prefix, reinstall, options)
+        logger.debug("Running: %s", ' '.join(shlex.quote(a) for a in cmd))
+        subprocess.check_output(cmd)
+
+    def bootstrap_pip(self, python):
+        """
+        Install the pip (and setuptools, where it's bundled) that comes with
+        build-python, as 'python -m venv' does.
+
+        :param python:  The virtual environment's interpreter.
+        """
+
+        subprocess.check_output([python, '-Im', 'ensurepip', '--upgrade',
+            '--default-pip'], stderr=subprocess.STDOUT)
+
+    def honours_platform_tags(self, platform_tags):
+        """
+        Return True if this installer can be used for a cross-python with the
+        given platform tags, and choose the same wheels cross-pip would.
+        """
+
+        return True
+
+    def identity(self):
+        """Something that changes when what install() does might"""
+        return (self.name,)
+
+
+class PipInstaller(Installer):
+    """
+    Installs packages with the interpreter's own pip.
+    """
+
+    name = 'pip'
+
+    def command(self, python, requirements, prefix=None, reinstall=False,
+            options=()):
+        cmd = [python, '-m', 'pip', '--disable-pip-version-check', 'install']
+        if reinstall:
+            cmd.append('--ignore-installed')
+        if prefix is not None:
+            cmd.append('--prefix=' + prefix)
+        return cmd + list(options) + list(requirements)
+
+
+class UvInstaller(Installer):
+    """
+    Installs packages with uv. uv asks the interpreter what platform it's
+    for, so cross-python gets packages for the host. But it works out which
+    manylinux tags to accept from the glibc version alone, rather than
+    taking a list, so it's only used for cross-python when there are no
+    platform tags to honour.
+
+    :param uv:  Path to the uv executable.
+    """
+
+    name = 'uv'
+
+    def __init__(self, uv):
+        self.uv = uv
+
+    @classmethod
+    def find(cls):
+        """
+        Return a UvInstaller for the uv named by $CROSSENV_UV, or else the
+        one on PATH, or None if there isn't one.
+        """
+
+        uv = os.environ.get('CROSSENV_UV') or shutil.which('uv')
+        if not uv:
+            return None
+        return cls(os.path.abspath(uv))
+
+    def command(self, python, requirements, prefix=None, reinstall=False,
+            options=()):
+        cmd = [self.uv, 'pip', 'install', '--quiet', '--python', python]
+        if reinstall:
+            cmd.append('--reinstall')
+        if prefix is not None:
+            cmd.append('--prefix=' + prefix)
+        return cmd + list(options) + list(requirements)
+
+    def bootstrap_pip(self, python):
+        # ensurepip runs pip to install its own wheels, which is most of the
+        # time it takes to make a virtual environment. uv can install the
+        # same wheels much faster.
+        spec = importlib.util.find_spec('ensurepip')
+        wheels = []
+        if spec is not None:
+            bundled = os.path.join(os.path.dirname(spec.origin), '_bundled')
+            wheels = sorted(glob.glob(os.path.join(bundled, '*.whl')))
+        if not any(os.path.basename(w).startswith('pip-') for w in wheels):
+            logger.debug("No bundled pip wheel found; using ensurepip")
+            super().bootstrap_pip(python)
+            return
+        self.install(python, wheels, options=['--no-index'])
+
+    def honours_platform_tags(self, platform_tags):
+        return not platform_tags
+
+    def identity(self):
+        return (self.name, self.uv, utils.file_identity(self.uv))
+
+
+def get_installer(name):
+    """
+    Return the Installer called name. 'auto' means uv, if it can be found,
+    and pip otherwise.
+
+    :param name:    One of INSTALLERS.
+    """
+
+    if name not in INSTALLERS:
+        raise ValueError("Unknown installer %r" % name)
+    if name in ('uv', 'auto'):
+        uv = UvInstaller.find()
+        if uv is not None:
+            return uv
+        if name == 'uv':
+            raise ValueError("Cannot find uv. Put it on PATH, or set "
+                    "CROSSENV_UV to its path.")
+    return PipInstaller()
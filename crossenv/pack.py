@@ -0,0 +1,387 @@
+"""
+Pack a crossenv into an archive, and unpack it somewhere else.
+"""
+
+import ast
+import bz2
+import gzip
+import io
+import json
+import logging
+import lzma
+import marshal
+import os
+import pprint
+import re
+import shlex
+import sys
+import tarfile
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Stands in for ENV_DIR in the text files and symlinks of an archive
+PLACEHOLDER = '@@CROSSENV_ENV_DIR@@'
+
+# The first member of every archive, describing the rest
+MANIFEST = '.crossenv-pack'
+
+# Set in the PAX headers of members that contain the placeholder
+RELOCATE_HEADER = 'CROSSENV.relocate'
+
+# Files that only mean something while the environment is in use
+_RUNTIME_FILES = ('lib/forkserver.sock', 'lib/forkserver.pid')
+
+_COMPRESSION = [
+    ('.tar.gz', 'gz'),
+    ('.tgz', 'gz'),
+    ('.tar.bz2', 'bz2'),
+    ('.tar.xz', 'xz'),
+    ('.tar.zst', 'zst'),
+    ('.tzst', 'zst'),
+    ('.tar', ''),
+]
+
+def _compression(archive):
+    for suffix, compression in _COMPRESSION:
+        if archive.endswith(suffix):
+            return compression
+    raise ValueError("Unknown archive type %r. Use one of: %s" % (archive,
+            ', '.join(suffix for suffix, _ in _COMPRESSION)))
+
+def _open_zstd(path, mode):
+    """Open a zstd-compressed file, with Python's own zstd support if it has
+    any (3.14 and later), or else with the zstandard package."""
+    try:
+        from compression import zstd
+    except ImportError:
+        zstd = None
+    if zstd is not None:
+        return zstd.open(path, mode)
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("%s: zstd archives need the zstandard package, or "
+                "Python 3.14 or later" % path)
+    fp = open(path, mode)
+    if mode == 'wb':
+        return zstandard.ZstdCompressor().stream_writer(fp, closefd=True)
+    return zstandard.ZstdDecompressor().stream_reader(fp, closefd=True)
+
+def _open_archive(archive, mode):
+    """Open archive as a stream, for reading ('r') or writing ('w'). Returns
+    the TarFile, and the file under it, which must be closed after it."""
+    compression = _compression(archive)
+    # tarfile would compress as hard as it can, which is very slow for
+    # little gain, so open the compressed stream ourselves.
+    if compression == 'gz':
+        fp = gzip.open(archive, mode + 'b', compresslevel=6)
+    elif compression == 'bz2':
+        fp = bz2.open(archive, mode + 'b')
+    elif compression == 'xz':
+        fp = lzma.open(archive, mode + 'b')
+    elif compression == 'zst':
+        fp = _open_zstd(archive, mode + 'b')
+    else:
+        fp = open(archive, mode + 'b')
+    try:
+        return tarfile.open(fileobj=fp, mode=mode + '|',
+                format=tarfile.PAX_FORMAT), fp
+    except Exception:
+        fp.close()
+        raise
+
+def pack(env_dir, archive):
+    """
+    Write the environment at env_dir to archive, in a single pass. Where the
+    environment's own path appears in a symlink or text file, it's replaced
+    with a placeholder, and the file is marked for unpack() to put the new
+    path in. Binary files that mention it are left alone, and fixed up
+    afterwards by relocate().
+
+    :param env_dir: The environment to pack.
+    :param archive: The archive to write. Its compression is chosen by its
+                    name: .tar, .tar.gz, .tar.bz2, .tar.xz, or .tar.zst.
+    """
+
+    env_dir = os.path.abspath(env_dir)
+    if not os.path.exists(os.path.join(env_dir, 'lib',
+            '_crossenv_bootstrap.py')):
+        raise ValueError("%s is not a crossenv" % env_dir)
+    if not os.path.isdir(os.path.join(env_dir, 'cross')):
+        raise ValueError("%s was made with --cross-prefix, so it can't be "
+                "packed" % env_dir)
+
+    from . import __version__
+    manifest = json.dumps({
+        'format': 1,
+        'crossenv': __version__,
+        'env_dir': env_dir,
+        'placeholder': PLACEHOLDER,
+    }, sort_keys=True).encode('utf-8')
+
+    old_re = re.compile(os.fsencode(utils.path_pattern(env_dir)))
+    old_bytes = os.fsencode(env_dir)
+    placeholder = os.fsencode(PLACEHOLDER)
+
+    tar, fp = _open_archive(archive, 'w')
+    try:
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+
+        for dirpath, dirnames, filenames in os.walk(env_dir):
+            dirnames.sort()
+            links = [d for d in dirnames
+                     if os.path.islink(os.path.join(dirpath, d))]
+            dirnames[:] = [d for d in dirnames if d not in links]
+            for name in [None] + links + sorted(filenames):
+                path = dirpath if name is None else os.path.join(dirpath, name)
+                arcname = os.path.relpath(path, env_dir)
+                if arcname in _RUNTIME_FILES:
+                    continue
+                info = tar.gettarinfo(path, arcname)
+                info.uid = info.gid = 0
+                info.uname = info.gname = ''
+                if info.issym():
+                    target = utils.replace_path(info.linkname, env_dir,
+                            PLACEHOLDER)
+                    if target != info.linkname:
+                        info.linkname = target
+                        info.pax_headers = {RELOCATE_HEADER: '1'}
+                    tar.addfile(info)
+                elif info.isfile():
+                    with open(path, 'rb') as src:
+                        data = src.read()
+                    if (old_bytes in data and b'\0' not in data and
+                            old_re.search(data)):
+                        data = old_re.sub(lambda m: placeholder, data)
+                        info.size = len(data)
+                        info.pax_headers = {RELOCATE_HEADER: '1'}
+                    tar.addfile(info, io.BytesIO(data))
+                elif info.isdir():
+                    tar.addfile(info)
+                # Anything else, such as a socket, is left out
+    finally:
+        tar.close()
+        fp.close()
+
+def unpack(archive, env_dir):
+    """
+    Extract an archive made by pack() to env_dir, in a single pass, putting
+    env_dir where the placeholder is. Then relocate() fixes up what's left.
+
+    :param archive: The archive to read.
+    :param env_dir: Where to put the environment. It must be new, or empty,
+                    and its path mustn't need quoting in the shell.
+    """
+
+    env_dir = os.path.abspath(env_dir)
+    # The launchers quote the environment's path for the shell, so the new
+    # path has to read the same quoted or not.
+    if shlex.quote(env_dir) != env_dir:
+        raise ValueError("Can't unpack to %s: its path would need quoting "
+                "in the shell" % env_dir)
+    if os.path.exists(env_dir) and (not os.path.isdir(env_dir) or
+            os.listdir(env_dir)):
+        raise ValueError("%s already exists, and isn't empty" % env_dir)
+
+    tar, fp = _open_archive(archive, 'r')
+    try:
+        first = tar.next()
+        if first is None or first.name != MANIFEST:
+            raise ValueError("%s wasn't made by crossenv pack" % archive)
+        manifest = json.loads(tar.extractfile(first).read().decode('utf-8'))
+        if manifest.get('format') != 1:
+            raise ValueError("%s was made by an incompatible version of "
+                    "crossenv" % archive)
+        placeholder = manifest['placeholder']
+
+        dirs = []
+        rewritten = []
+        utils.mkdir_if_needed(env_dir)
+        real_env_dir = os.path.realpath(env_dir)
+        while True:
+            # Iterating over tar would start from the manifest again
+            info = tar.next()
+            if info is None:
+                break
+            name = os.path.normpath(info.name)
+            if (os.path.isabs(name) or name == '..' or
+                    name.startswith('..' + os.sep)):
+                raise ValueError("%s: unsafe path %r" % (archive, info.name))
+            path = os.path.normpath(os.path.join(env_dir, name))
+            parent = os.path.realpath(os.path.dirname(path))
+            if (name != os.curdir and
+                    os.path.commonpath([parent, real_env_dir]) != real_env_dir):
+                raise ValueError("%s: unsafe path %r" % (archive, info.name))
+            marked = info.pax_headers.get(RELOCATE_HEADER) == '1'
+
+            if info.isdir():
+                os.makedirs(path, exist_ok=True)
+                dirs.append((path, info))
+                continue
+            if os.path.lexists(path):
+                utils.remove_path(path)
+            if info.issym():
+                target = info.linkname
+                if marked:
+                    target = target.replace(placeholder, env_dir)
+                os.symlink(target, path)
+                continue
+            if not info.isfile():
+                raise ValueError("%s: unexpected member %r" % (archive,
+                        info.name))
+
+            data = tar.extractfile(info).read()
+            if marked:
+                data = data.replace(os.fsencode(placeholder),
+                        os.fsencode(env_dir))
+                if data.startswith(b'#!'):
+                    data = os.fsencode(utils.fixup_shebang(
+                            os.fsdecode(data)))
+                rewritten.append(path)
+            with open(path, 'wb') as out:
+                out.write(data)
+            os.chmod(path, info.mode & 0o777)
+            os.utime(path, (info.mtime, info.mtime))
+
+        # Only now are the directories finished with
+        for path, info in reversed(dirs):
+            os.chmod(path, info.mode & 0o777)
+            os.utime(path, (info.mtime, info.mtime))
+    finally:
+        tar.close()
+        fp.close()
+
+    relocate(env_dir, manifest['env_dir'], rewritten)
+
+def relocate(env_dir, old_env_dir, rewritten):
+    """
+    Fix up what a plain search and replace can't, after an environment has
+    moved from old_env_dir to env_dir: the patch cache, which holds compiled
+    code, the config vars snapshot, and the bytecode for modules whose source
+    changed.
+
+    :param env_dir:     Where the environment is now.
+    :param old_env_dir: Where it was made.
+    :param rewritten:   The files that have already had their paths changed.
+    """
+
+    lib_path = os.path.join(env_dir, 'lib')
+    bootstrap = os.path.join(lib_path, '_crossenv_bootstrap.py')
+    _rebuild_patch_cache(lib_path, bootstrap)
+
+    snapshot = os.path.join(lib_path, 'config_vars.marshal')
+    if os.path.exists(snapshot):
+        with open(snapshot, 'rb') as fp:
+            config_vars = marshal.load(fp)
+        config_vars = utils.replace_path(config_vars, old_env_dir, env_dir)
+        with utils.overwrite_file(snapshot, 'wb', perms=0o644) as fp:
+            marshal.dump(config_vars, fp)
+
+    for path in set(rewritten) | {bootstrap}:
+        if path.endswith('.py'):
+            utils.recompile_module(path)
+
+    for name in ('build/bin/python', 'cross/pyvenv.cfg'):
+        path = os.path.join(env_dir, name)
+        if name.endswith('.cfg'):
+            with open(path) as fp:
+                for line in fp:
+                    if line.split()[0:2] == ['home', '=']:
+                        path = line.split('=', 1)[1].strip()
+        else:
+            path = os.path.realpath(path)
+        if not os.path.exists(path):
+            logger.warning("%s doesn't exist here. The environment needs the "
+                    "same build-python and host-python, at the same paths, "
+                    "as where it was packed.", path)
+
+_patch_cache_key_re = re.compile(
+        r"^_PATCH_CACHE_KEY = \(MAGIC_NUMBER, '([0-9a-f]+)'\)$", re.M)
+_embedded_patches_re = re.compile(
+        r'^_EMBEDDED_PATCH_CACHE = (.*?)\n'
+        r'_EMBEDDED_PATCH_SOURCES = (.*?)\n_patch_code = ', re.M | re.S)
+
+def _rebuild_patch_cache(lib_path, bootstrap):
+    """Compile the patches again from their relocated sources, and tell the
+    bootstrap about the new cache."""
+
+    with open(bootstrap) as fp:
+        src = fp.read()
+    m = _embedded_patches_re.search(src)
+    if m is None or _patch_cache_key_re.search(src) is None:
+        raise ValueError("Can't find the patch cache in %s" % bootstrap)
+
+    embedded = ast.literal_eval(m.group(2))
+    if embedded:
+        sources = {os.path.join(lib_path, name): source
+                   for name, source in embedded.items()}
+    else:
+        cache_path = os.path.join(lib_path, 'patches.marshal')
+        with open(cache_path, 'rb') as fp:
+            key, code = marshal.load(fp)
+        sources = {}
+        for name in code:
+            path = os.path.join(lib_path, name)
+            with open(path, encoding='utf-8') as fp:
+                sources[path] = fp.read()
+
+    cache = utils.compile_code_cache(sources)
+    if embedded:
+        src = (src[:m.start(1)] + pprint.pformat(cache) + src[m.end(1):])
+    else:
+        with utils.overwrite_file(cache_path, 'wb', perms=0o644) as fp:
+            marshal.dump(cache, fp)
+    src = _patch_cache_key_re.sub(
+            lambda m: "_PATCH_CACHE_KEY = (MAGIC_NUMBER, %r)" % cache[0][1],
+            src)
+    with utils.overwrite_file(bootstrap, perms=0o644) as fp:
+        fp.write(src)
+
+def main(argv):
+    """crossenv pack and crossenv unpack"""
+    import argparse
+    parser = argparse.ArgumentParser(prog='crossenv',
+        description="""Move crossenvs from one place to another""")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    pack_parser = commands.add_parser('pack',
+        help="""Write an environment to an archive that can be unpacked
+                anywhere.""")
+    pack_parser.add_argument('ENV_DIR',
+        help="""The environment to pack.""")
+    pack_parser.add_argument('ARCHIVE',
+        help="""The archive to write. The compression is chosen by its name:
+                .tar, .tar.gz, .tar.bz2, .tar.xz, or .tar.zst.""")
+
+    unpack_parser = commands.add_parser('unpack',
+        help="""Extract an environment from an archive made by pack, and
+                change its paths to match where it now is.""")
+    unpack_parser.add_argument('ARCHIVE',
+        help="""The archive to read.""")
+    unpack_parser.add_argument('ENV_DIR',
+        help="""Where to put the environment. It must not exist yet, or be
+                empty, and its path can't contain spaces or other characters
+                that need quoting in the shell.""")
+
+    for p in (pack_parser, unpack_parser):
+        p.add_argument('-v', '--verbose', action='count', default=0,
+            help="""Verbose mode. May be specified multiple times to increase
+                    verbosity.""")
+
+    args = parser.parse_args(argv)
+    utils.configure_logging(args.verbose)
+    try:
+        if args.command == 'pack':
+            pack(args.ENV_DIR, args.ARCHIVE)
+        else:
+            unpack(args.ARCHIVE, args.ENV_DIR)
+    except Exception as e:
+        logger.error('%s', e)
+        logger.debug('Traceback:', exc_info=True)
+        sys.exit(1)
@@ -0,0 +1,233 @@
+"""
+A content-addressed store of files, shared between crossenvs by hard links.
+
+Cross-python also loads this module, from a copy in the environment, to put
+what cross-pip installs in the store. So it mustn't import anything but the
+standard library at module level.
+"""
+
+import csv
+import errno
+import fnmatch
+import hashlib
+import logging
+import os
+import stat
+import sys
+
+logger = logging.getLogger(__name__)
+
+# The parts of an environment that are put in the store. Scripts and
+# configuration are left alone: they name the environment they're in, so
+# they're never shared, and some are rewritten in place.
+STORED_DIRS = (os.path.join('build', 'lib'), os.path.join('cross', 'lib'))
+
+# Of the environment's own lib directory, only crossenv's generated modules
+# are stored. These change while the environment is in use, and some are
+# written in place, so they never are, whatever they're called.
+NEVER_STORED = ('forkserver.pid', 'forkserver.sock', 'exposed*.txt',
+        'config_vars.marshal', 'patches.marshal')
+
+class Store:
+    """
+    Files are stored by the SHA-256 of their contents, and whether they're
+    executable, and are hard linked into environments. Stored files are made
+    read-only, since changing one in place would change it everywhere; pip,
+    like crossenv, replaces files rather than rewriting them. A stored file
+    that no environment links to any more has a link count of 1, which is
+    how gc() finds them.
+
+    :param path:    The store's directory. It must be on the same filesystem
+                    as the environments that use it. It's created when it's
+                    first needed.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.objects = os.path.join(self.path, 'objects')
+
+    def blob_path(self, digest, executable):
+        name = digest[2:] + ('-x' if executable else '')
+        return os.path.join(self.objects, digest[:2], name)
+
+    def add(self, path):
+        """
+        Put a file in the store, or replace it with a link to the same file
+        already in the store. Files that already have other links, such as
+        those already in the store, are left alone.
+
+        :param path:    The file to add.
+        :returns:       The number of bytes saved.
+        """
+
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode) or st.st_nlink > 1:
+            return 0
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(1 << 20), b''):
+                digest.update(chunk)
+        executable = bool(st.st_mode & 0o111)
+        blob = self.blob_path(digest.hexdigest(), executable)
+
+        # gc() might remove a blob just as we find it, so try again if so
+        for attempt in range(2):
+            if not os.path.exists(blob):
+                os.chmod(path, 0o555 if executable else 0o444)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                try:
+                    _link(path, blob)
+                    return 0
+                except FileExistsError:
+                    pass # someone else just stored it
+
+            tmp = os.path.join(os.path.dirname(path),
+                    '.crossenv-store-%d-%s' % (os.getpid(),
+                    os.path.basename(path)))
+            try:
+                _link(blob, tmp)
+            except FileNotFoundError:
+                continue
+            os.replace(tmp, path)
+            return st.st_size
+        return 0
+
+    def add_tree(self, root):
+        """
+        Add every file under root, except bytecode, which names its source
+        file, and so is rarely the same twice.
+
+        :returns:   The number of bytes saved.
+        """
+
+        saved = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if d != '__pycache__']
+            for name in filenames:
+                if name.endswith('.pyc'):
+                    continue
+                saved += self.add(os.path.join(dirpath, name))
+        return saved
+
+    def add_record(self, root, record_path):
+        """
+        Add the files an installed distribution's RECORD lists, except
+        bytecode, and anything outside root, such as its scripts.
+
+        :param root:        The directory the RECORD's paths are relative to.
+        :param record_path: The RECORD file.
+        :returns:           The number of bytes saved.
+        """
+
+        root = os.path.abspath(root)
+        saved = 0
+        with open(record_path, newline='') as fp:
+            for row in csv.reader(fp):
+                if not row or row[0].endswith('.pyc'):
+                    continue
+                path = os.path.normpath(os.path.join(root, row[0]))
+                if (os.path.commonpath([path, root]) != root or
+                        not os.path.isfile(path)):
+                    continue
+                saved += self.add(path)
+        return saved
+
+    def add_env(self, env_dir):
+        """
+        Add the files of a crossenv that are worth sharing: crossenv's own
+        modules, and everything installed in build-python and cross-python.
+
+        :returns:   The number of bytes saved.
+        """
+
+        saved = 0
+        lib = os.path.join(env_dir, 'lib')
+        try:
+            names = sorted(os.listdir(lib))
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if name.endswith('.py') and not any(
+                    fnmatch.fnmatch(name, pattern) for pattern in NEVER_STORED):
+                saved += self.add(os.path.join(lib, name))
+        for subdir in STORED_DIRS:
+            saved += self.add_tree(os.path.join(env_dir, subdir))
+        return saved
+
+    def gc(self, dry_run=False):
+        """
+        Remove stored files that no environment links to any more.
+
+        :param dry_run: If True, only say what would be removed.
+        :returns:       The number of files and bytes removed.
+        """
+
+        count = 0
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(self.objects):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                st = os.lstat(path)
+                if st.st_nlink > 1:
+                    continue
+                if not dry_run:
+                    os.unlink(path)
+                count += 1
+                size += st.st_size
+        return count, size
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        raise ValueError("Can't link %s to %s: the store must be on the same "
+                "filesystem as the environments that use it" % (src, dst))
+
+def main(argv):
+    """crossenv store"""
+    import argparse
+    from . import utils
+    parser = argparse.ArgumentParser(prog='crossenv store',
+        description="""Manage a store of files shared between crossenvs""")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    add_parser = commands.add_parser('add',
+        help="""Share the files of existing environments through the store,
+                such as after build-pip installs something.""")
+    add_parser.add_argument('STORE',
+        help="""The store's directory.""")
+    add_parser.add_argument('ENV_DIR', nargs='+',
+        help="""An environment to add.""")
+
+    gc_parser = commands.add_parser('gc',
+        help="""Remove stored files that no environment uses any more.""")
+    gc_parser.add_argument('STORE',
+        help="""The store's directory.""")
+    gc_parser.add_argument('-n', '--dry-run', action='store_true',
+        help="""Only say how much would be removed.""")
+
+    for p in (add_parser, gc_parser):
+        p.add_argument('-v', '--verbose', action='count', default=0,
+            help="""Verbose mode. May be specified multiple times to increase
+                    verbosity.""")
+
+    args = parser.parse_args(argv)
+    utils.configure_logging(args.verbose)
+    store = Store(args.STORE)
+    try:
+        if args.command == 'add':
+            for env_dir in args.ENV_DIR:
+                saved = store.add_env(env_dir)
+                logger.info("%s: saved %d bytes", env_dir, saved)
+        else:
+            count, size = store.gc(args.dry_run)
+            print('%s %d files, %d bytes' % (
+                'Would remove' if args.dry_run else 'Removed', count, size))
+    except Exception as e:
+        logger.error('%s', e)
+        logger.debug('Traceback:', exc_info=True)
+        sys.exit(1)
@@ -1,10 +1,19 @@
+import base64
 import contextlib
+import configparser
+import logging
 import tempfile
 import shutil
 import os
 from textwrap import dedent
 import pkgutil
 import re
+import shlex
+import hashlib
+import marshal
+import importlib.util
+import py_compile
+import sys
 
 # We're using %-style formatting everywhere because it's more convenient for
 # building Python and Bourne Shell source code. We'll build some helpers to
@@ -49,15 +58,18 @@ class TemplateContext:
 @contextlib.contextmanager
 def overwrite_file(name, mode='w', perms=None):
     '''A context manager that will overwrite the given file
-    only after it was closed with no error'''
+    only after it was closed with no error. The file is replaced, never
+    written through, so other hard links to it keep what they had.'''
 
-    fp = tempfile.NamedTemporaryFile(mode, delete=False)
+    dirname, basename = os.path.split(os.path.abspath(name))
+    fp = tempfile.NamedTemporaryFile(mode, delete=False, dir=dirname,
+            prefix='.%s-' % basename)
     try:
         yield fp
         fp.close()
         if perms is not None:
             os.chmod(fp.name, perms)
-        shutil.move(fp.name, name)
+        os.replace(fp.name, name)
     except Exception as e:
         fp.close()
         try:
@@ -84,12 +96,152 @@ def symlink(src, dst):
     os.symlink(src, dst)
 
 def make_launcher(src, dst):
+    src = shlex.quote(src)
     with overwrite_file(dst, perms=0o755) as fp:
         fp.write(dedent(F('''\
             #!/bin/sh
             exec %(src)s "$@"
             ''', locals())))
 
+def make_inline_launcher(launcher_body, dst, script=None):
+    """Write a launcher at dst that does the cross-python launcher's job
+    itself, rather than exec'ing it, so that there is only one exec between
+    dst and build-python. If script is given, cross-python runs it."""
+    with overwrite_file(dst, perms=0o755) as fp:
+        fp.write('#!/bin/sh\n')
+        if script is not None:
+            fp.write('set -- %s "$@"\n' % shlex.quote(script))
+        fp.write(launcher_body)
+
+# The second line of the /bin/sh trick for long shebangs, which names the
+# interpreter. Console scripts in the cross environment use a variant that
+# sets up cross-python itself; see pip-_vendor-distlib-scripts-patch.py.
+_sh_trick_re = re.compile(br"'''(?:exec|true)' (.+?)"
+                          br'(?: "?\$0"? "\$@"|; set -- "\$0" "\$@")\s*$')
+
+def script_interpreter(path):
+    """Return the interpreter that runs the script at path, or None if it
+    isn't a script."""
+    try:
+        with open(path, 'rb') as fp:
+            head = fp.read(512)
+    except OSError:
+        return None
+    lines = head.split(b'\n', 2)
+    if not lines[0].startswith(b'#!'):
+        return None
+    interp = lines[0][2:]
+    if interp.strip() == b'/bin/sh' and len(lines) > 1:
+        m = _sh_trick_re.match(lines[1])
+        if m:
+            interp = m.group(1)
+    try:
+        return shlex.split(os.fsdecode(interp))[0]
+    except (ValueError, IndexError):
+        return None
+
+def read_console_scripts(path):
+    """Return the console_scripts of a distribution's entry_points.txt, as a
+    dict of name to 'module:function'. A missing file has none."""
+    parser = configparser.ConfigParser(delimiters=('=',), interpolation=None)
+    parser.optionxform = str
+    parser.read(path)
+    if not parser.has_section('console_scripts'):
+        return {}
+    return dict(parser.items('console_scripts'))
+
+def find_console_script(console_scripts, name):
+    """Return the entry point for the script called name. Installers also
+    write versioned copies of some scripts, such as pip3.11 for pip."""
+    if name in console_scripts:
+        return console_scripts[name]
+    return console_scripts.get(re.sub(r'-?[0-9.]+$', '', name))
+
+# Keep these in step with pip-_vendor-distlib-scripts-patch.py.tmpl, which
+# writes the console scripts cross-pip installs.
+_console_script_template = '''\
+# -*- coding: utf-8 -*-
+import re
+import sys
+from %(module)s import %(import_name)s
+if __name__ == '__main__':
+    sys.argv[0] = re.sub(r'(-script\\.pyw|\\.exe)?$', '', sys.argv[0])
+    sys.exit(%(func)s())
+'''
+
+def record_hash(path):
+    """Return the hash and size of a file, as a RECORD file lists them."""
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest())
+    return ['sha256=' + digest.rstrip(b'=').decode('ascii'), str(len(data))]
+
+def cross_script_shebang(executable, launcher_body=None):
+    """Return the start of a script that runs executable, as pip writes it in
+    cross-python: always through /bin/sh, since executable is itself a
+    script. If launcher_body is given, the script sets up cross-python
+    itself, rather than going through its launcher."""
+    if ' ' in executable:
+        executable = '"%s"' % executable
+    if launcher_body is not None:
+        return ('#!/bin/sh\n'
+                "'''true' %s; set -- \"$0\" \"$@\"\n"
+                "%s'''\n" % (executable, launcher_body))
+    return ('#!/bin/sh\n'
+            "'''exec' %s \"$0\" \"$@\"\n"
+            "' '''\n" % executable)
+
+def write_console_script(dst, entry_point, executable, launcher_body=None):
+    """Write a console script for entry_point that runs executable, as pip
+    would in cross-python. See cross_script_shebang()."""
+    module, func = [part.strip() for part in entry_point.split(':')]
+    func = func.split('[')[0].strip()
+    import_name = func.split('.')[0]
+    mkdir_if_needed(os.path.dirname(dst))
+    with overwrite_file(dst, perms=0o755) as fp:
+        fp.write(cross_script_shebang(executable, launcher_body))
+        fp.write(_console_script_template % locals())
+
+def replace_shebang(path, shebang):
+    """Replace the start of the script at path, up to the end of its shebang
+    line, or of the /bin/sh trick for long shebangs, with shebang."""
+    with open(path, 'rb') as fp:
+        lines = fp.read().split(b'\n')
+    end = 1
+    if lines[0].strip() == b'#!/bin/sh' and len(lines) > 1:
+        if _sh_trick_re.match(lines[1]):
+            end = 2
+            while end < len(lines) and lines[end - 1].rstrip() not in (
+                    b"' '''", b"'''"):
+                end += 1
+    perms = os.stat(path).st_mode & 0o7777
+    with overwrite_file(path, 'wb', perms=perms) as fp:
+        fp.write(shebang.encode('utf-8'))
+        fp.write(b'\n'.join(lines[end:]))
+
+def shell_env_commands(env_vars):
+    """Convert (name, op, value) tuples, as from parse_env_vars, into Bourne
+    shell commands that behave like the pywrapper.py equivalent."""
+    lines = []
+    for name, assign, value in env_vars:
+        if not name.isidentifier():
+            raise ValueError("Invalid variable name %r" % name)
+        value = shlex.quote(value)
+        if assign == '=':
+            lines.append(F('%(name)s=%(value)s', locals()))
+        elif assign == '?=':
+            lines.append(F('[ -n "${%(name)s+x}" ] || %(name)s=%(value)s',
+                locals()))
+        elif assign == '+=':
+            lines.append(F('%(name)s="${%(name)s-}"%(value)s', locals()))
+        elif assign == ':=':
+            lines.append(F('%(name)s="${%(name)s+$%(name)s:}"%(value)s',
+                locals()))
+        else:
+            continue
+        lines.append('export %s' % name)
+    return '\n'.join(lines)
+
 def fixup_shebang(src):
     """Alter the shebang line if it's too long, as can happen somethings with
     e.g., Jenkins. This trick is taken from what pip does."""
@@ -115,13 +267,247 @@ def fixup_shebang(src):
     return preamble + src[end:]
 
 
-def install_script(name, dst, context=None, perms=0o755):
+def expand_script(name, context=None):
     srcname = os.path.join('scripts', name)
-    src = pkgutil.get_data(__package__, srcname)
+    src = pkgutil.get_data(__package__, srcname).decode()
     if context is not None:
-        src = context.expand(src.decode())
+        src = context.expand(src)
+    return src
+
+def install_script(name, dst, context=None, perms=0o755):
+    src = expand_script(name, context)
+    write_script(src, dst, perms)
+
+def write_script(src, dst, perms=0o755):
     src = fixup_shebang(src)
     mkdir_if_needed(os.path.dirname(dst))
 
     with overwrite_file(dst, perms=perms) as fp:
         fp.write(src)
+
+def configure_logging(verbose):
+    """Log to stderr, at a level for the number of times -v was given"""
+    if verbose == 1:
+        level = logging.INFO
+    elif verbose > 1:
+        level = logging.DEBUG
+    else:
+        level = logging.WARNING
+    logging.basicConfig(level=level, format='%(levelname)s: %(message)s')
+
+def default_cache_dir():
+    """Where crossenv keeps things between runs, following the XDG base
+    directory spec."""
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'crossenv')
+
+def file_identity(path):
+    """Something that changes when the file at path does, or None if there's
+    no such file."""
+    try:
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    return (path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+class ProbeCache:
+    """Results of probing something expensive to ask, saved between runs.
+    Each result is stored under a name along with a key, and is only good
+    for as long as the key is the same. Everything must be marshallable.
+
+    :param path:    The cache file, or None to disable caching.
+    :param refresh: If True, ignore what's already cached, but still save
+                    new results.
+    """
+
+    def __init__(self, path, refresh=False):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if path is None or refresh:
+            return
+        try:
+            with open(path, 'rb') as fp:
+                entries = marshal.load(fp)
+        except (OSError, EOFError, ValueError, TypeError):
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def get(self, name, key):
+        """Return what was saved for name under key, or None"""
+        try:
+            saved_key, value = self.entries[name]
+        except (KeyError, TypeError, ValueError):
+            return None
+        if saved_key != key:
+            return None
+        return value
+
+    def put(self, name, key, value):
+        if self.path is None:
+            return
+        try:
+            marshal.dumps((key, value))
+        except ValueError:
+            return # Not something we can save
+        self.entries[name] = (key, value)
+        self.dirty = True
+
+    def save(self):
+        if self.path is None or not self.dirty:
+            return
+        mkdir_if_needed(os.path.dirname(self.path))
+        with overwrite_file(self.path, 'wb', perms=0o644) as fp:
+            marshal.dump(self.entries, fp)
+        self.dirty = False
+
+def path_pattern(path):
+    """A regular expression for path, but not for a longer path that merely
+    starts or ends with the same characters."""
+    pattern = re.escape(path)
+    return r'(?<![\w.~/-])' + pattern + r'(?![\w.~-])'
+
+def replace_path(obj, old, new):
+    """Replace the path old with new in every string in obj, which may be a
+    string, or a dict, list, or tuple of them, however nested."""
+    if isinstance(obj, str):
+        return re.sub(path_pattern(old), lambda m: new, obj)
+    if isinstance(obj, dict):
+        return {replace_path(k, old, new): replace_path(v, old, new)
+                for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(replace_path(v, old, new) for v in obj)
+    return obj
+
+def copy_tree_replacing(src, dst, old, new):
+    """Copy the directory tree at src to dst, replacing the path old with new
+    in symlinks and text files along the way. Binary files, including .pyc
+    files, are copied as they are, as are the times of files that didn't
+    need changing. Text files that start with a shebang that becomes too
+    long are given the usual /bin/sh trick.
+
+    :param src: The directory to copy.
+    :param dst: Where to copy it. It may already exist, and anything in the
+                way is overwritten.
+    :param old: The path to replace, typically src.
+    :param new: What to replace it with, typically dst.
+    """
+
+    old_bytes = os.fsencode(old)
+    text_re = re.compile(os.fsencode(path_pattern(old)))
+    new_bytes = os.fsencode(new)
+    for dirpath, dirnames, filenames in os.walk(src):
+        reldir = os.path.relpath(dirpath, src)
+        dstdir = os.path.normpath(os.path.join(dst, reldir))
+        os.makedirs(dstdir, exist_ok=True)
+        shutil.copymode(dirpath, dstdir)
+
+        # os.walk() lists symlinks to directories along with the directories
+        links = [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]
+        dirnames[:] = [d for d in dirnames if d not in links]
+        for name in links + filenames:
+            srcpath = os.path.join(dirpath, name)
+            dstpath = os.path.join(dstdir, name)
+            if os.path.islink(dstpath):
+                os.unlink(dstpath)
+
+            if os.path.islink(srcpath):
+                target = replace_path(os.readlink(srcpath), old, new)
+                if os.path.lexists(dstpath):
+                    remove_path(dstpath)
+                os.symlink(target, dstpath)
+                continue
+
+            with open(srcpath, 'rb') as fp:
+                data = fp.read()
+            # Searching for the plain path first is much quicker
+            rewrite = (old_bytes in data and b'\0' not in data and
+                       text_re.search(data))
+            if rewrite:
+                data = text_re.sub(lambda m: new_bytes, data)
+                if data.startswith(b'#!'):
+                    data = os.fsencode(fixup_shebang(os.fsdecode(data)))
+            with open(dstpath, 'wb') as fp:
+                fp.write(data)
+            if rewrite:
+                shutil.copymode(srcpath, dstpath)
+            else:
+                shutil.copystat(srcpath, dstpath)
+
+def compile_code_cache(sources):
+    """Compile Python sources into a cache of code objects, keyed by the
+    current interpreter's magic number and a hash of the sources. Each code
+    object is marshalled separately and stored by base name, so that readers
+    only pay to load what they use.
+
+    :param sources: A dictionary of filename to source code.
+    :returns:       A (key, code) tuple, where key is (magic, hex digest) and
+                    code is a dictionary of base name to marshalled code.
+    """
+
+    ctx = hashlib.sha256()
+    code = {}
+    for filename, src in sorted(sources.items()):
+        name = os.path.basename(filename)
+        ctx.update(name.encode('utf-8') + b'\0' + src.encode('utf-8') + b'\0')
+        code[name] = marshal.dumps(compile(src, filename, 'exec'))
+
+    key = (importlib.util.MAGIC_NUMBER, ctx.hexdigest())
+    return key, code
+
+def compile_module(path, unchecked_hash=False):
+    """Write the bytecode for a module to its usual __pycache__ location.
+
+    :param path:            The module's source file.
+    :param unchecked_hash:  If True, write an unchecked-hash .pyc, which the
+                            import system uses without checking the source.
+    """
+
+    kwargs = {}
+    if unchecked_hash:
+        kwargs['invalidation_mode'] = \
+                py_compile.PycInvalidationMode.UNCHECKED_HASH
+    py_compile.compile(path, doraise=True, **kwargs)
+
+def recompile_module(path):
+    """Bring the bytecode for a module up to date after its source has
+    changed, written the same way it was before. Bytecode for other Python
+    versions can't be, so it's removed instead.
+
+    :param path:    The module's source file.
+    """
+
+    cache_dir = os.path.join(os.path.dirname(path), '__pycache__')
+    prefix = os.path.splitext(os.path.basename(path))[0] + '.'
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(prefix) or not name.endswith('.pyc'):
+            continue
+        cfile = os.path.join(cache_dir, name)
+        with open(cfile, 'rb') as fp:
+            header = fp.read(8)
+        if (header[:4] != importlib.util.MAGIC_NUMBER or
+                cfile != importlib.util.cache_from_source(path)):
+            os.unlink(cfile)
+            continue
+
+        kwargs = {}
+        if hasattr(py_compile, 'PycInvalidationMode'):
+            # The flags that say how the .pyc is checked. See PEP 552.
+            modes = {
+                0: py_compile.PycInvalidationMode.TIMESTAMP,
+                1: py_compile.PycInvalidationMode.UNCHECKED_HASH,
+                3: py_compile.PycInvalidationMode.CHECKED_HASH,
+            }
+            flags = int.from_bytes(header[4:8], 'little')
+            if flags not in modes:
+                os.unlink(cfile)
+                continue
+            kwargs['invalidation_mode'] = modes[flags]
+        py_compile.compile(path, cfile=cfile, doraise=True, **kwargs)
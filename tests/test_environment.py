@@ -1,8 +1,14 @@
+import json
 import os
 import re
+import shutil
+import signal
+import subprocess
 from textwrap import dedent
 
-from .testutils import make_crossenv
+import pytest
+
+from .testutils import make_crossenv, CrossenvEnvironment
 
 def test_uname(crossenv, architecture):
     # We don't test all of uname. We currently have no values for release or
@@ -169,6 +175,42 @@ def test_cross_expose(crossenv):
     out = crossenv.check_output(['cross-expose', '--list'])
     assert b'colorama' not in out
 
+def test_cross_expose_index(crossenv):
+    # cross-expose records where the exposed metadata is. pkg_resources uses
+    # that, but can do without it.
+    crossenv.check_call(['build-pip', 'install', 'colorama'])
+    crossenv.check_call(['cross-expose', 'colorama'])
+    index = crossenv.crossenv_dir / 'lib' / 'exposed-index.txt'
+    with open(index) as fp:
+        assert 'colorama\t' in fp.read()
+
+    script = dedent('''\
+            import pkg_resources
+            print(pkg_resources.get_distribution('colorama').project_name)
+            ''')
+    out = crossenv.check_output(['python', '-c', script],
+            universal_newlines=True)
+    assert out.strip() == 'colorama'
+
+    os.unlink(index)
+    out = crossenv.check_output(['python', '-c', script],
+            universal_newlines=True)
+    assert out.strip() == 'colorama'
+
+def test_cross_expose_all(crossenv):
+    crossenv.check_call(['build-pip', 'install', 'colorama'])
+    crossenv.check_call(['cross-expose', ':all:'])
+    out = crossenv.check_output(['cross-expose', '--list'],
+            universal_newlines=True)
+    assert 'colorama' in out.split()
+    assert 'pip' not in out.split()
+
+    # Names are matched the way pip would match them
+    crossenv.check_call(['cross-expose', '-u', 'Colorama'])
+    out = crossenv.check_output(['cross-expose', '--list'],
+            universal_newlines=True)
+    assert 'colorama' not in out.split()
+
 def test_machine_override(tmp_path, host_python, build_python):
     crossenv = make_crossenv(tmp_path, host_python, build_python,
             '--machine=foobar')
@@ -180,3 +222,724 @@ def test_machine_override(tmp_path, host_python, build_python):
             universal_newlines=True)
     out = out.strip()
     assert out == 'foobar foobar'
+
+@pytest.mark.parametrize('launcher', ['sh', 'python'])
+def test_launcher(tmp_path, host_python, build_python, launcher):
+    crossenv = make_crossenv(tmp_path, host_python, build_python,
+            '--launcher=' + launcher,
+            '--env=FOO=bar',
+            '--env=BAZ?=default')
+
+    crossenv.setenv('BAZ', 'mine')
+    crossenv.setenv('PYTHONHOME', '/not/a/real/home')
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import os, sys
+            print(sys.executable)
+            print(sys.prefix)
+            print(os.environ['FOO'], os.environ['BAZ'])
+            print(os.environ['PYTHONHOME'])
+            ''')],
+            universal_newlines=True)
+    out = out.splitlines()
+    cross_dir = crossenv.crossenv_dir / 'cross'
+    assert os.path.dirname(out[0]) == str(cross_dir / 'bin')
+    assert out[1] == str(cross_dir)
+    assert out[2] == 'bar mine'
+    assert out[3] == '/not/a/real/home'
+
+def test_frozen_modules(crossenv):
+    # Patches must still be applied when build-python has frozen modules, and
+    # we shouldn't need to turn them off to do it.
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sys
+            print(sys._xoptions.get('frozen_modules'), sys.cross_compiling)
+            ''')],
+            universal_newlines=True)
+    assert out.strip() == 'None True'
+
+def test_patch_cache_fallback(tmp_path, host_python, build_python,
+        architecture):
+    # Patches are normally loaded from a precompiled cache, but we should
+    # still work from source if it's missing.
+    crossenv = make_crossenv(tmp_path, host_python, build_python)
+    os.unlink(crossenv.crossenv_dir / 'lib' / 'patches.marshal')
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import os, platform
+            print(os.uname().machine, platform.uname().machine)
+            ''')],
+            universal_newlines=True)
+    out = out.strip()
+    assert out == '{0} {0}'.format(architecture.machine)
+
+def test_single_file_bootstrap(tmp_path, host_python, build_python,
+        architecture):
+    crossenv = make_crossenv(tmp_path, host_python, build_python,
+            '--single-file-bootstrap')
+    lib = crossenv.crossenv_dir / 'lib'
+    assert not list(lib.glob('*-patch.py'))
+    assert not (lib / 'patches.marshal').exists()
+
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import os, platform, sysconfig
+            print(os.uname().machine, platform.uname().machine)
+            print(sysconfig.get_platform())
+            ''')],
+            universal_newlines=True)
+    out = out.splitlines()
+    assert out[0] == '{0} {0}'.format(architecture.machine)
+    expected = '{}-{}'.format(architecture.system, architecture.machine)
+    assert out[1] == expected.lower()
+
+def test_build_path_changes(crossenv, tmp_path):
+    # sys.build_path is searched just before the stdlib, and changes to either
+    # it or sys.path must take effect right away.
+    build_dir = tmp_path / 'build_dir'
+    prepend_dir = tmp_path / 'prepend_dir'
+    for d in (build_dir, prepend_dir):
+        d.mkdir()
+        with open(d / 'crossenv_test_mod.py', 'w') as fp:
+            fp.write('WHERE = %r\n' % d.name)
+
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sys
+            sys.build_path.append(%r)
+            import crossenv_test_mod
+            print(crossenv_test_mod.WHERE)
+            del sys.modules['crossenv_test_mod']
+            sys.path.insert(0, %r)
+            import crossenv_test_mod
+            print(crossenv_test_mod.WHERE)
+            ''' % (str(build_dir), str(prepend_dir)))],
+            universal_newlines=True)
+    assert out.split() == ['build_dir', 'prepend_dir']
+
+def test_build_path_new_module(crossenv, tmp_path):
+    # Modules added to a sys.build_path directory after it was first searched
+    # are found once importlib.invalidate_caches() is called, as with sys.path.
+    build_dir = tmp_path / 'build_dir'
+    build_dir.mkdir()
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sys, importlib
+            sys.build_path.append(%r)
+            try:
+                import crossenv_test_mod
+            except ImportError:
+                print('missing')
+            with open(%r, 'w') as fp:
+                fp.write('WHERE = "build_dir"\\n')
+            importlib.invalidate_caches()
+            import crossenv_test_mod
+            print(crossenv_test_mod.WHERE)
+            ''' % (str(build_dir), str(build_dir / 'crossenv_test_mod.py')))],
+            universal_newlines=True)
+    assert out.split() == ['missing', 'build_dir']
+
+def test_build_path_cwd(crossenv, tmp_path):
+    # An empty sys.build_path entry means the current directory, as it does
+    # on sys.path.
+    with open(tmp_path / 'crossenv_test_mod.py', 'w') as fp:
+        fp.write('WHERE = "cwd"\n')
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sys
+            sys.path = [p for p in sys.path if p]
+            sys.build_path.insert(0, '')
+            import crossenv_test_mod
+            print(crossenv_test_mod.WHERE)
+            ''')],
+            cwd=str(tmp_path), universal_newlines=True)
+    assert out.split() == ['cwd']
+
+def test_subprocess_spawn(tmp_path, host_python, build_python):
+    # Only packaging and friends see the fake glibc version. subprocess should
+    # choose the same way of starting processes as build-python does.
+    crossenv = make_crossenv(tmp_path, host_python, build_python,
+            '--manylinux=manylinux2014')
+    script = dedent('''\
+            import subprocess
+            print(subprocess._USE_POSIX_SPAWN)
+            ''')
+    cross = crossenv.check_output(['cross-python', '-c', script],
+            universal_newlines=True)
+    build = crossenv.check_output(['build-python', '-c', script],
+            universal_newlines=True)
+    assert cross == build
+
+def test_config_vars_snapshot(tmp_path, host_python, build_python):
+    # The saved snapshot must give the same answers that sysconfig would have
+    # worked out for itself.
+    crossenv = make_crossenv(tmp_path, host_python, build_python)
+    script = dedent('''\
+            import sysconfig
+            for key, value in sorted(sysconfig.get_config_vars().items()):
+                print('%s=%r' % (key, value))
+            ''')
+    snapshot = crossenv.check_output(['python', '-c', script],
+            universal_newlines=True)
+
+    snapshot_path = crossenv.crossenv_dir / 'lib' / 'config_vars.marshal'
+    if snapshot_path.exists():
+        os.unlink(snapshot_path)
+    derived = crossenv.check_output(['python', '-c', script],
+            universal_newlines=True)
+    assert snapshot == derived
+
+@pytest.mark.parametrize('unchecked', [False, True])
+def test_precompiled_modules(tmp_path, host_python, build_python, unchecked):
+    # The modules we generate are compiled when the environment is created.
+    args = ['--unchecked-hash-pycs'] if unchecked else []
+    crossenv = make_crossenv(tmp_path, host_python, build_python, *args)
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import importlib, importlib.util, sysconfig
+            name = sysconfig._get_sysconfigdata_name()
+            path = importlib.import_module(name).__file__
+            with open(importlib.util.cache_from_source(path), 'rb') as fp:
+                print(int.from_bytes(fp.read(8)[4:], 'little'))
+            ''')],
+            universal_newlines=True)
+    flags = int(out)
+    if unchecked:
+        assert flags == 0x1
+    else:
+        assert not flags & 0x2
+
+def test_metadata_index(crossenv, tmp_path):
+    # importlib.metadata answers from an index, but must notice distributions
+    # being added, changed, or removed, as when pip runs mid-process.
+    site = tmp_path / 'site'
+    site.mkdir()
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sys, os, shutil
+            import importlib.metadata as metadata
+            sys.path.insert(0, %r)
+            def names():
+                return sorted(ep.name for dist in metadata.distributions()
+                              for ep in dist.entry_points
+                              if ep.group == 'crossenv_test')
+            def write(name, *commands):
+                path = os.path.join(sys.path[0], name + '-1.0.dist-info')
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, 'METADATA'), 'w') as fp:
+                    fp.write('Metadata-Version: 2.1\\nName: %%s\\n'
+                             'Version: 1.0\\n' %% name)
+                with open(os.path.join(path, 'entry_points.txt'), 'w') as fp:
+                    fp.write('[crossenv_test]\\n')
+                    for cmd in commands:
+                        fp.write('%%s = mod:func\\n' %% cmd)
+                return path
+            print(names())
+            path = write('foo', 'a')
+            print(names())
+            write('foo', 'b', 'cc')
+            print(names())
+            shutil.rmtree(path)
+            print(names())
+            ''' % str(site))],
+            universal_newlines=True)
+    assert out.splitlines() == ["[]", "['a']", "['b', 'cc']", "[]"]
+
+def test_forkserver(tmp_path, host_python, build_python, architecture):
+    # With cross-forkserver running, cross-python should behave exactly as it
+    # does without it.
+    crossenv = make_crossenv(tmp_path, host_python, build_python)
+    work = tmp_path / 'work'
+    work.mkdir()
+    crossenv.check_call(['cross-forkserver', 'start', '--preload=sysconfig'])
+    try:
+        out = crossenv.check_output(['cross-forkserver', 'status'],
+                universal_newlines=True)
+        assert out.startswith('running')
+
+        crossenv.setenv('FOO', 'bar')
+        result = crossenv.run(['python', '-c', dedent('''\
+                import os, sys
+                print(sys.argv[1:], os.getcwd(), os.environ['FOO'])
+                print(os.uname().machine, 'sysconfig' in sys.modules)
+                sys.stderr.write('to stderr\\n')
+                sys.exit(3)
+                '''), 'a', 'b'],
+                cwd=str(work),
+                input='', stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                universal_newlines=True)
+        assert result.returncode == 3
+        out = result.stdout.splitlines()
+        assert out[0] == "['a', 'b'] %s bar" % work
+        assert out[1] == '%s True' % architecture.machine
+        assert result.stderr == 'to stderr\n'
+
+        result = crossenv.run(['python', '-c',
+                'import os, signal; os.kill(os.getpid(), signal.SIGTERM)'])
+        assert result.returncode == -signal.SIGTERM
+
+        # Tracebacks start in the script, but are kept whole if it's the
+        # server that couldn't run it
+        script = work / 'fails.py'
+        script.write_text('def f():\n    1/0\nf()\n')
+        result = crossenv.run(['python', str(script)],
+                stderr=subprocess.PIPE, universal_newlines=True)
+        assert result.returncode == 1
+        lines = result.stderr.splitlines()
+        assert lines[1].startswith('  File "%s", line 3' % script)
+        assert lines[-1].startswith('ZeroDivisionError')
+        result = crossenv.run(['python', str(work / 'missing.py')],
+                stderr=subprocess.PIPE, universal_newlines=True)
+        assert result.returncode == 1
+        assert result.stderr.startswith('Traceback')
+        assert 'FileNotFoundError' in result.stderr
+
+        # Interpreter options aren't something a forked child can change, so
+        # they're handled without the server.
+        out = crossenv.check_output(['python', '-B', '-c',
+                'import sys; print(sys.dont_write_bytecode)'],
+                universal_newlines=True)
+        assert out.strip() == 'True'
+    finally:
+        crossenv.check_call(['cross-forkserver', 'stop'])
+
+    assert not (crossenv.crossenv_dir / 'lib' / 'forkserver.sock').exists()
+
+def test_console_script_launchers(crossenv, tmp_path):
+    # Console scripts for cross-python, and the cross-* aliases, set up
+    # cross-python themselves rather than exec'ing its launcher.
+    exec_link = re.compile(r'^exec %s/\.python\S* "\$@"$' %
+            re.escape(str(crossenv.crossenv_dir / 'cross' / 'bin')), re.M)
+    scripts = [
+        crossenv.crossenv_dir / 'cross' / 'bin' / 'pip',
+        crossenv.crossenv_dir / 'bin' / 'cross-pip',
+        crossenv.crossenv_dir / 'bin' / 'cross-python',
+    ]
+    for path in scripts:
+        assert exec_link.search(path.read_text())
+
+    out = crossenv.check_output(['cross-pip', '--version'],
+            universal_newlines=True)
+    assert out.startswith('pip ')
+
+    # Installing a package with a console script gets the same treatment
+    pkg = tmp_path / 'pkg'
+    pkg.mkdir()
+    (pkg / 'hello.py').write_text(dedent('''\
+            import sys, platform
+            def main():
+                print(sys.executable, platform.machine())
+            '''))
+    (pkg / 'setup.py').write_text(dedent('''\
+            from setuptools import setup
+            setup(name='hello', version='1.0', py_modules=['hello'],
+                  entry_points={'console_scripts': ['hello=hello:main']})
+            '''))
+    crossenv.check_call(['cross-pip', '--no-cache-dir', 'install', str(pkg)])
+    hello = crossenv.crossenv_dir / 'cross' / 'bin' / 'hello'
+    assert exec_link.search(hello.read_text())
+    out = crossenv.check_output([str(hello)], universal_newlines=True)
+    cross_python = crossenv.check_output(['python', '-c',
+            'import sys; print(sys.executable)'], universal_newlines=True)
+    assert out.split()[0] == cross_python.strip()
+
+def test_python_config(crossenv):
+    # cross-python-config answers without starting cross-python, but must
+    # agree with it.
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import sysconfig
+            print(sysconfig.get_config_var('EXT_SUFFIX'))
+            print(sysconfig.get_config_var('SOABI'))
+            print(sysconfig.get_platform())
+            print(sysconfig.get_path('include'))
+            ''')],
+            universal_newlines=True)
+    ext_suffix, soabi, platform, include = out.splitlines()
+
+    out = crossenv.check_output(['cross-python-config', '--extension-suffix',
+            '--config-var', 'SOABI', '--platform', '--includes'],
+            universal_newlines=True)
+    out = out.splitlines()
+    assert out[:3] == [ext_suffix, soabi, platform]
+    assert out[3].split()[0] == '-I' + include
+
+    out = crossenv.check_output(['cross-python-config', '--json'],
+            universal_newlines=True)
+    info = json.loads(out)
+    assert info['config-vars']['SOABI'] == soabi
+    assert info['extension-suffix'] == ext_suffix
+
+    result = crossenv.run(['cross-python-config', '--config-var',
+            'NOT_A_CONFIG_VAR'], stdout=subprocess.PIPE)
+    assert result.returncode == 1
+    assert result.stdout == b''
+
+def test_emulation(crossenv, host_python, build_python):
+    # The in-process API must agree with cross-python, and must leave this
+    # interpreter as it found it.
+    query = dedent('''\
+            import json, os, platform, sys, sysconfig
+            def query():
+                return [sys.platform, sysconfig.get_platform(),
+                        sysconfig.get_config_var('SOABI'),
+                        sysconfig.get_config_var('CC'),
+                        list(os.uname())[::4], platform.machine()]
+            ''')
+    out = crossenv.check_output(['python', '-c',
+            query + 'print(json.dumps(query()))'],
+            universal_newlines=True)
+    expected = json.loads(out)
+
+    out = build_python.check_output([build_python.binary, '-c',
+            query + dedent('''\
+            from crossenv import CrossEmulation
+            emu = CrossEmulation.for_host(sys.argv[1])
+            before = query()
+            print(json.dumps({
+                'api': [emu.sys_platform, emu.get_platform(),
+                        emu.get_config_var('SOABI'),
+                        emu.get_config_var('CC'),
+                        list(emu.uname())[::4], emu.platform_uname().machine],
+                'patched': emu.call(query),
+                'restored': query() == before,
+            }))
+            '''), str(host_python.binary)],
+            universal_newlines=True)
+    result = json.loads(out)
+    assert result['api'] == expected
+    assert result['patched'] == expected
+    assert result['restored']
+
+def test_trace(crossenv, tmp_path):
+    trace_dir = tmp_path / 'trace'
+    crossenv.setenv('CROSSENV_TRACE', str(trace_dir))
+    try:
+        crossenv.check_call(['python', '-c', dedent('''\
+                import subprocess, sys
+                subprocess.check_call([sys.executable, '-c', 'import platform'])
+                ''')])
+    finally:
+        crossenv.setenv('CROSSENV_TRACE', None)
+
+    assert len(list(trace_dir.glob('crossenv-*.json'))) == 2
+    out = crossenv.check_output(['cross-trace-merge', str(trace_dir)],
+            universal_newlines=True)
+    events = json.loads(out)
+
+    spans = {}
+    labels = {}
+    for event in events:
+        if event['ph'] == 'X':
+            spans.setdefault(event['pid'], set()).add(event['name'])
+        elif event['name'] == 'process_labels':
+            labels[event['pid']] = event['args']['labels']
+
+    # Only the child has a traced parent
+    assert len(spans) == 2 and len(labels) == 1
+    child, label = labels.popitem()
+    parent = (set(spans) - {child}).pop()
+    assert label == 'parent %d' % parent
+
+    for pid in (parent, child):
+        assert {'launcher', 'bootstrap', 'cross-python'} <= spans[pid]
+    assert 'import subprocess' in spans[parent]
+    assert 'patch platform' in spans[child]
+
+def test_host_cache(tmp_path, host_python, build_python):
+    cache_home = tmp_path / 'cache'
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache_home))
+    query = ['python', '-c', dedent('''\
+            import sysconfig
+            print(sysconfig.get_platform(), sysconfig.get_config_var('CC'))
+            ''')]
+
+    crossenv = make_crossenv(tmp_path / 'nocache', host_python, build_python,
+            '--no-host-cache', env=env)
+    expected = crossenv.check_output(query, universal_newlines=True)
+    assert not cache_home.exists()
+
+    for name in ('cold', 'warm'):
+        crossenv = make_crossenv(tmp_path / name, host_python, build_python,
+                env=env)
+        out = crossenv.check_output(query, universal_newlines=True)
+        assert out == expected
+    assert len(list(cache_home.glob('crossenv/host-info/*.marshal'))) == 1
+
+    crossenv = make_crossenv(tmp_path / 'refresh', host_python, build_python,
+            '--refresh-host-cache', env=env)
+    out = crossenv.check_output(query, universal_newlines=True)
+    assert out == expected
+
+def test_cross_pip_matches_build_pip(crossenv):
+    # cross-pip and its setuptools are installed at whatever versions
+    # build-python has.
+    def versions(pip):
+        out = crossenv.check_output([pip, '--disable-pip-version-check',
+                'freeze', '--all'], universal_newlines=True)
+        return [line for line in out.split()
+                if line.split('==')[0] in ('pip', 'setuptools')]
+
+    build = versions('build-pip')
+    assert any(line.startswith('pip==') for line in build)
+    assert versions('cross-pip') == build
+
+def test_jobs(tmp_path, host_python, build_python):
+    # Environments made together work just like those made one at a time, and
+    # each one's log comes out in one piece, in order.
+    envs = [tmp_path / name for name in ('first', 'second', 'third')]
+    first = make_crossenv(envs[0], host_python, build_python, *envs[1:],
+            '--jobs', '3', '-v')
+
+    log = [line for line in first.creation_log.splitlines()
+           if line.startswith('INFO:')]
+    steps = log[:len(log) // 3]
+    assert steps[0] == 'INFO: Creating build-python environment'
+    assert log == steps * 3
+
+    query = ['python', '-c', 'import sys; print(sys.prefix)']
+    for env_dir in envs:
+        crossenv = CrossenvEnvironment(build_python, env_dir)
+        out = crossenv.check_output(query, universal_newlines=True)
+        assert out.strip() == str(env_dir / 'cross')
+
+    # One bad ENV_DIR doesn't stop the others, and is reported by name.
+    (tmp_path / 'file').write_text('')
+    result = build_python.run([build_python.binary, '-m', 'crossenv',
+            host_python.binary, tmp_path / 'file', tmp_path / 'fourth',
+            '--without-pip', '--jobs', '2'],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+    assert result.returncode == 1
+    assert str(tmp_path / 'file') in result.stdout
+    assert (tmp_path / 'fourth/bin/cross-python').exists()
+
+def test_env_cache(tmp_path, host_python, build_python):
+    # An environment copied from the template must work just like the one the
+    # template was made from, and mustn't need it, or the template, anymore.
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'))
+    query = ['python', '-c', dedent('''\
+            import sys, sysconfig
+            print(sys.prefix)
+            print(sysconfig.get_platform(), sysconfig.get_config_var('CC'))
+            ''')]
+
+    first_dir = tmp_path / 'a'
+    first = make_crossenv(first_dir, host_python, build_python, '-v',
+            '--env-cache', env=env)
+    assert 'template' not in first.creation_log
+    expected = first.check_output(query, universal_newlines=True)
+    expected_prefix = first.check_output(['cross-python-config', '--prefix'],
+            universal_newlines=True)
+    templates = list(tmp_path.glob('cache/crossenv/env-templates/*/env'))
+    assert len(templates) == 1
+
+    clone_dir = tmp_path / 'a-longer-name'
+    clone = make_crossenv(clone_dir, host_python, build_python, '-v',
+            '--env-cache', env=env)
+    assert 'Copying environment template' in clone.creation_log
+    shutil.rmtree(str(first_dir))
+
+    out = clone.check_output(query, universal_newlines=True)
+    assert out == expected.replace(str(first_dir), str(clone_dir))
+    out = clone.check_output(['cross-pip', '--disable-pip-version-check',
+            'freeze', '--all'], universal_newlines=True)
+    assert 'pip==' in out
+    out = clone.check_output(['cross-python-config', '--prefix'],
+            universal_newlines=True)
+    assert out == expected_prefix.replace(str(first_dir), str(clone_dir))
+    with open(str(clone_dir / 'cross/bin/activate')) as fp:
+        assert '(a-longer-name)' in fp.read()
+
+    # Nothing should point back at the original.
+    for path in clone_dir.rglob('*'):
+        if path.is_symlink():
+            assert str(first_dir) not in os.readlink(str(path))
+        elif path.is_file() and path.suffix not in ('.pyc', '.marshal'):
+            data = path.read_bytes()
+            assert (str(first_dir) + '/').encode() not in data, path
+
+    # Only with --env-cache
+    crossenv = make_crossenv(tmp_path / 'b', host_python, build_python, '-v',
+            env=env)
+    assert 'template' not in crossenv.creation_log
+
+def test_pack(tmp_path, host_python, build_python):
+    # An unpacked environment must work wherever it ends up, even after the
+    # original is gone.
+    query = ['python', '-c', dedent('''\
+            import sys, sysconfig
+            print(sys.prefix)
+            print(sysconfig.get_platform(), sysconfig.get_config_var('CC'))
+            ''')]
+
+    first_dir = tmp_path / 'a'
+    first = make_crossenv(first_dir, host_python, build_python)
+    expected = first.check_output(query, universal_newlines=True)
+    archive = tmp_path / 'env.tar.gz'
+    build_python.check_call([build_python.binary, '-m', 'crossenv', 'pack',
+            first_dir, archive])
+    shutil.rmtree(str(first_dir))
+
+    env_dir = tmp_path / 'somewhere' / 'else'
+    build_python.check_call([build_python.binary, '-m', 'crossenv', 'unpack',
+            archive, env_dir])
+    crossenv = CrossenvEnvironment(build_python, env_dir)
+    out = crossenv.check_output(query, universal_newlines=True)
+    assert out == expected.replace(str(first_dir), str(env_dir))
+    out = crossenv.check_output(['cross-pip', '--disable-pip-version-check',
+            'freeze', '--all'], universal_newlines=True)
+    assert 'pip==' in out
+
+    # The patches still come from the precompiled cache
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import _crossenv_bootstrap
+            print(len(_crossenv_bootstrap._load_patch_cache()))
+            ''')], universal_newlines=True)
+    assert int(out) > 0
+
+    for path in env_dir.rglob('*'):
+        if path.is_symlink():
+            assert str(first_dir) not in os.readlink(str(path))
+        elif path.is_file() and path.suffix not in ('.pyc', '.marshal'):
+            data = path.read_bytes()
+            assert (str(first_dir) + '/').encode() not in data, path
+
+    # Only into somewhere new
+    result = build_python.run([build_python.binary, '-m', 'crossenv',
+            'unpack', archive, env_dir], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+    assert result.returncode == 1
+    assert "isn't empty" in result.stdout
+
+    # Nor anywhere the launchers would need to quote
+    result = build_python.run([build_python.binary, '-m', 'crossenv',
+            'unpack', archive, tmp_path / 'with space'],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            universal_newlines=True)
+    assert result.returncode == 1
+    assert 'quoting' in result.stdout
+
+def test_pack_unchecked_hash_pycs(tmp_path, host_python, build_python):
+    # Bytecode rewritten on unpack must be checked the same way as before.
+    first_dir = tmp_path / 'a'
+    make_crossenv(first_dir, host_python, build_python,
+            '--unchecked-hash-pycs')
+    archive = tmp_path / 'env.tar'
+    build_python.check_call([build_python.binary, '-m', 'crossenv', 'pack',
+            first_dir, archive])
+    env_dir = tmp_path / 'b'
+    build_python.check_call([build_python.binary, '-m', 'crossenv', 'unpack',
+            archive, env_dir])
+
+    pycs = list((env_dir / 'lib' / '__pycache__').glob('*.pyc'))
+    assert pycs
+    for pyc in pycs:
+        flags = int.from_bytes(pyc.read_bytes()[4:8], 'little')
+        assert flags == 1, pyc
+
+def test_store(tmp_path, host_python, build_python):
+    # Environments made with the same store share their files, including what
+    # cross-pip installs later, and gc only removes what nothing uses.
+    store = tmp_path / 'store'
+    first_dir = tmp_path / 'a'
+    second_dir = tmp_path / 'b'
+    first = make_crossenv(first_dir, host_python, build_python,
+            '--store', store)
+    second = make_crossenv(second_dir, host_python, build_python,
+            '--store', store)
+
+    def links(env_dir, path):
+        return os.stat(str(env_dir / 'cross/lib' / path)).st_nlink
+    pip_init = next((first_dir / 'cross/lib').glob(
+            'python*/site-packages/pip/__init__.py'))
+    pip_init = pip_init.relative_to(first_dir / 'cross/lib')
+    assert links(first_dir, pip_init) == links(second_dir, pip_init) > 2
+
+    # Only what cross-pip installed is added, not the rest of site-packages
+    handmade = pip_init.parent.parent / 'handmade.py'
+    (first_dir / 'cross/lib' / handmade).write_text('X = 1\n')
+    for crossenv in (first, second):
+        crossenv.check_call(['cross-pip', '--no-cache-dir', 'install',
+                'packaging'])
+    packaging_init = pip_init.parent.parent / 'packaging' / '__init__.py'
+    assert links(second_dir, packaging_init) == 3
+    assert links(first_dir, handmade) == 1
+
+    shutil.rmtree(str(first_dir))
+    out = build_python.check_output([build_python.binary, '-m', 'crossenv',
+            'store', 'gc', store], universal_newlines=True)
+    assert not out.startswith('Removed 0 ')
+    assert links(second_dir, packaging_init) == 2
+    second.check_call(['python', '-c', 'import packaging'])
+    out = build_python.check_output([build_python.binary, '-m', 'crossenv',
+            'store', 'gc', store], universal_newlines=True)
+    assert out.startswith('Removed 0 ')
+
+def test_store_forkserver(tmp_path, host_python, build_python):
+    # Adding an environment to a store shares crossenv's modules, but not
+    # what's written while it's in use, such as a stale forkserver pid file.
+    store = tmp_path / 'store'
+    env_dir = tmp_path / 'env'
+    crossenv = make_crossenv(env_dir, host_python, build_python)
+    pid_file = env_dir / 'lib' / 'forkserver.pid'
+    pid_file.write_text('99999999\n')
+    build_python.check_call([build_python.binary, '-m', 'crossenv', 'store',
+            'add', store, env_dir])
+    assert os.stat(str(env_dir / 'lib' / '_crossenv_bootstrap.py')).st_nlink == 2
+    for name in ('forkserver.pid', 'config_vars.marshal', 'patches.marshal'):
+        assert os.stat(str(env_dir / 'lib' / name)).st_nlink == 1
+
+    crossenv.check_call(['cross-forkserver', 'start'])
+    try:
+        out = crossenv.check_output(['cross-forkserver', 'status'],
+                universal_newlines=True)
+        assert out.startswith('running')
+    finally:
+        crossenv.check_call(['cross-forkserver', 'stop'])
+
+def test_cross_pip_copied(tmp_path, host_python, build_python):
+    # cross-pip is copied from build-python rather than installed, and must
+    # still be a working install of its own, with scripts for cross-python.
+    crossenv = make_crossenv(tmp_path, host_python, build_python, '-vv')
+    assert re.search(r'Copying pip-.*\.dist-info', crossenv.creation_log)
+
+    freeze = ['--disable-pip-version-check', 'freeze', '--all']
+    build = crossenv.check_output(['build-pip'] + freeze,
+            universal_newlines=True)
+    cross = crossenv.check_output(['cross-pip'] + freeze,
+            universal_newlines=True)
+    assert cross == build
+
+    out = crossenv.check_output([str(tmp_path / 'cross/bin/pip'),
+            '--version'], universal_newlines=True)
+    assert out.startswith('pip ')
+    crossenv.check_call(['cross-pip', '--disable-pip-version-check',
+            'uninstall', '-y', 'setuptools'])
+    out = crossenv.check_output(['build-pip'] + freeze,
+            universal_newlines=True)
+    assert 'setuptools==' in out
+
+def test_installer_uv(tmp_path, host_python, build_python):
+    if shutil.which('uv') is None:
+        pytest.skip('uv not found on PATH')
+
+    # uv installs build-pip, and cross-uv gives the scripts it installs a
+    # shebang that sets up cross-python.
+    env_dir = tmp_path / 'env'
+    crossenv = make_crossenv(env_dir, host_python, build_python,
+            '--installer=uv')
+    out = crossenv.check_output(['build-pip', '--version'],
+            universal_newlines=True)
+    assert out.startswith('pip ')
+    out = crossenv.check_output(['cross-pip', '--version'],
+            universal_newlines=True)
+    assert out.startswith('pip ')
+
+    crossenv.check_call(['cross-uv', 'pip', 'install', 'packaging', 'wheel'])
+    out = crossenv.check_output([str(env_dir / 'cross/bin/wheel'),
+            'version'], universal_newlines=True)
+    assert out.startswith('wheel ')
+    out = crossenv.check_output(['python', '-c', dedent('''\
+            import packaging, sys
+            print(packaging.__file__.startswith(sys.prefix))
+            ''')], universal_newlines=True)
+    assert out.strip() == 'True'
+
+    # uv can't choose by platform tags, so cross-python gets pip instead.
+    crossenv = make_crossenv(tmp_path / 'tagged', host_python, build_python,
+            '--installer=uv', '-v',
+            '--platform-tag=manylinux_2_17_x86_64')
+    assert 'Using pip for cross-python' in crossenv.creation_log
+    assert not (tmp_path / 'tagged/bin/cross-uv').exists()